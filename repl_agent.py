@@ -1,9 +1,39 @@
+import array
+import ast
+import bisect
+import codecs
+import concurrent.futures
+import contextlib
+import cProfile
+import ctypes
+import dis
+import errno
+import functools
+import hashlib
+import hmac
 import io
+import ipaddress
 import json
+import multiprocessing
 import os
+import pickle
+import pstats
+import re
+import shutil
+import signal
+import socket
+import socketserver
+import sqlite3
+import statistics
 import sys
 import tempfile
+import threading
 import time
+import timeit
+import types
+import warnings
+import weakref
+from collections import OrderedDict
 
 from openai import OpenAI
 
@@ -13,11 +43,1496 @@ The REPL environment is initialized with:
 1. A `context` variable that contains extremely important information about your query. You should check the content of the `context` variable to understand what you are working with. Make sure you look through it sufficiently as you answer your query.
 2. The ability to use `print()` statements to view the output of your REPL code and continue your reasoning.
 
+To find things in `context`, prefer the `search_context` tool over writing search code: it returns matching lines with their line numbers, offsets and surrounding lines in one step. Use mode "literal" for exact text, "regex" for patterns, and "terms" to rank passages by how many of several keywords they contain.
+
+For CPU-heavy passes over a large string `context`, the REPL also provides `pmap(fn, chunks=None)`, which applies `fn` to line-aligned chunks of `context` (or to the given `chunks`) in parallel worker processes and returns the results in order, and `pscan(pattern)`, which returns `(offset, match)` pairs for a regex over the whole of `context`.
+
+To split `context` for sub-LLM calls, use `plan_chunks(max_tokens, overlap=0, boundary="paragraph")` (boundary can also be "line" or "record") instead of slicing by characters: it packs whole paragraphs, lines or list items into chunks of at most `max_tokens` tokens and returns them with `start`, `end`, `tokens` and `.text`. The plan is cached until `context` changes, so call it again rather than storing copies.
+
+Avoid keeping several large copies of `context` (lowercased, split, tokenized) around: `memory_usage()` shows the size of each variable, and `del` frees the ones you no longer need.
+
+If `context` grows while you work (a followed log, for example), `new_context()` returns only what was appended since your previous cell.
+
+When your answer is a large object (a long list, a table, a dict), do not print it. Call `final(value)` or `FINAL_VAR("variable_name")` instead: this ends the session and returns the object itself to the user.
+
+If your code is slow, start a cell with `%time`, `%timeit` or `%prun` to time it or to see the functions that take the most cumulative time.
+
 Make sure to explicitly look through the entire context in REPL before answering your query. You can use the REPL environment to help you understand your context. Think step by step carefully, plan, and execute this plan immediately in your response. Remember to explicitly answer the original query in your final answer."""
 
+# run() swaps sys.stdout/sys.stderr and the working directory, which are
+# process-wide, so cells from different agents must not interleave.
+_EXEC_LOCK = threading.RLock()
+
+# Leading %time / %timeit / %prun (or %%-cell form) with optional -n/-r/-l flags
+_MAGIC_RE = re.compile(r"\s*%%?(timeit|time|prun)\b((?:[ \t]+-[nrl][ \t]*\d+)*)")
+
+
+def _format_seconds(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e3), ("µs", 1e6)):
+        if seconds >= 1 / scale:
+            return f"{seconds * scale:.3g} {unit}"
+    return f"{seconds * 1e9:.3g} ns"
+
+
+# Work item for pmap workers. Set just before the pool is forked so children
+# inherit the function and the context buffer instead of receiving pickles.
+_PMAP_JOB = None
+
+
+def _line_chunks(text, n):
+    """Split text into at most n (start, end) ranges that end on newlines."""
+    size = max(1, -(-len(text) // max(1, n)))
+    bounds, start = [], 0
+    while start < len(text):
+        end = text.find("\n", min(start + size, len(text)) - 1)
+        end = len(text) if end == -1 else end + 1
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def _pmap_worker(i):
+    fn, text, chunks = _PMAP_JOB
+    if text is None:
+        return fn(chunks[i])
+    start, end = chunks[i]
+    return fn(text[start:end])
+
+
+def _pscan_chunk(pattern, flags, start, chunk):
+    return [(start + m.start(), m.group(0)) for m in re.finditer(pattern, chunk, flags)]
+
+
+def _pmap(state, fn, chunks=None, processes=None):
+    global _PMAP_JOB
+    processes = processes or os.cpu_count() or 1
+    if chunks is None:
+        text = state.get("context")
+        if not isinstance(text, str):
+            raise TypeError("pmap without chunks needs a string `context`")
+        chunks = _line_chunks(text, processes * 4)
+    else:
+        text, chunks = None, list(chunks)
+    # Without fork (Windows, some macOS setups) functions defined in the REPL
+    # cannot reach a worker, so fall back to mapping in-process.
+    parallel = (
+        processes > 1
+        and len(chunks) > 1
+        and "fork" in multiprocessing.get_all_start_methods()
+    )
+    _PMAP_JOB = (fn, text, chunks)
+    try:
+        if not parallel:
+            return [_pmap_worker(i) for i in range(len(chunks))]
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(min(processes, len(chunks))) as pool:
+            return pool.map(_pmap_worker, range(len(chunks)))
+    finally:
+        _PMAP_JOB = None
+
+
+def _pscan(state, pattern, flags=0, processes=None):
+    text = state.get("context")
+    if not isinstance(text, str):
+        raise TypeError("pscan needs a string `context`")
+    bounds = _line_chunks(text, (processes or os.cpu_count() or 1) * 4)
+    # Chunks are passed as offsets; forked workers slice the inherited text.
+    scan = functools.partial(_pscan_chunk, pattern, flags)
+    hits = _pmap(
+        state,
+        lambda bound: scan(bound[0], text[bound[0] : bound[1]]),
+        chunks=bounds,
+        processes=processes,
+    )
+    return [hit for chunk_hits in hits for hit in chunk_hits]
+
+
+# Context window sizes in tokens, matched by longest model-name prefix
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-5": 400000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4-mini": 200000,
+    "gemini-": 1048576,
+    "models/gemini-": 1048576,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+
+# USD per million (input, output) tokens, matched by longest model-name prefix
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-5": (1.25, 10.00),
+    "gpt-5-mini": (0.25, 2.00),
+    "gpt-5-nano": (0.05, 0.40),
+    "o3": (2.00, 8.00),
+    "o4-mini": (1.10, 4.40),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+
+# Rough tokenizer pieces: short letter runs, up to 3 digits, or any other
+# non-space character (punctuation, CJK ideographs, emoji ...).
+_TOKEN_PIECE_RE = re.compile(r"[A-Za-z]{1,4}|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def context_window_for(model):
+    prefixes = [p for p in MODEL_CONTEXT_WINDOWS if model.startswith(p)]
+    return (
+        MODEL_CONTEXT_WINDOWS[max(prefixes, key=len)]
+        if prefixes
+        else DEFAULT_CONTEXT_WINDOW
+    )
+
+
+def estimate_cost(model, usage):
+    """USD cost of a {"prompt_tokens", "completion_tokens"} usage, or None if unpriced."""
+    name = model.removeprefix("models/")
+    prefixes = [p for p in MODEL_PRICES if name.startswith(p)]
+    if not prefixes:
+        return None
+    price_in, price_out = MODEL_PRICES[max(prefixes, key=len)]
+    return (
+        usage["prompt_tokens"] * price_in + usage["completion_tokens"] * price_out
+    ) / 1e6
+
+
+# Raises an exception in another thread (CPython); None where unavailable
+_set_async_exc = getattr(
+    getattr(ctypes, "pythonapi", None), "PyThreadState_SetAsyncExc", None
+)
+
+
+@contextlib.contextmanager
+def _time_limit(seconds, label="Cell"):
+    """Raise TimeoutError in the block after seconds.
+
+    The main thread uses SIGALRM. Other threads (server handlers, map-reduce
+    workers) get the exception injected by a watchdog thread, which takes
+    effect at the next bytecode: a blocking call into C (sleep, socket
+    reads) is only interrupted once it returns. Where neither is possible a
+    RuntimeWarning is issued and the block runs unbounded.
+    """
+    if seconds is None:
+        yield
+        return
+    message = f"{label} exceeded its {seconds:.1f}s time limit"
+    if threading.current_thread() is not threading.main_thread() or not hasattr(
+        signal, "setitimer"
+    ):
+        if _set_async_exc is None:
+            warnings.warn(
+                f"{label} time limit of {seconds:.1f}s cannot be enforced here",
+                RuntimeWarning,
+                stacklevel=3,
+            )
+            yield
+            return
+        with _thread_time_limit(seconds, message):
+            yield
+        return
+    active = [True]
+
+    def expire(signum, frame):
+        if active[0]:
+            raise TimeoutError(message)
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    # Keep re-firing so a timeout caught once (e.g. by run()'s fallback that
+    # re-executes a failed last-line eval) still ends the cell
+    signal.setitimer(signal.ITIMER_REAL, max(seconds, 1e-3), 0.05)
+    try:
+        yield
+    finally:
+        active[0] = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+@contextlib.contextmanager
+def _thread_time_limit(seconds, message):
+    """_time_limit for threads without signals: a watchdog injects the error."""
+    # Injected exceptions are instantiated without arguments
+    timeout = type(
+        "TimeoutError",
+        (TimeoutError,),
+        {"__init__": lambda self: TimeoutError.__init__(self, message)},
+    )
+    target = ctypes.c_ulong(threading.get_ident())
+    lock, done = threading.Lock(), threading.Event()
+
+    def watchdog():
+        delay = max(seconds, 1e-3)
+        # Re-fire, as with SIGALRM, until the block has exited
+        while not done.wait(delay):
+            with lock:
+                if done.is_set():
+                    return
+                _set_async_exc(target, ctypes.py_object(timeout))
+            delay = 0.05
+
+    threading.Thread(target=watchdog, daemon=True).start()
+    try:
+        yield
+    finally:
+        while True:
+            # An injection can still land here; retry until the watchdog is
+            # stopped and any pending injection is cleared
+            try:
+                with lock:
+                    done.set()
+                    _set_async_exc(target, None)
+                break
+            except TimeoutError:
+                continue
+
+
+class _Budget:
+    """Wall-clock, token and cost limits for one chat() call."""
+
+    def __init__(self, model, deadline=None, max_tokens_total=None, max_cost=None):
+        if max_cost is not None and estimate_cost(model, _NO_USAGE) is None:
+            raise ValueError(
+                f"No price known for model {model!r}; add it to MODEL_PRICES"
+            )
+        self.model = model
+        self.end = None if deadline is None else time.monotonic() + deadline
+        self.max_tokens_total = max_tokens_total
+        self.max_cost = max_cost
+
+    def time_left(self):
+        return None if self.end is None else max(0.0, self.end - time.monotonic())
+
+    def exhausted(self, usage):
+        """Name of the first limit that has run out, or None."""
+        if self.end is not None and self.time_left() <= 0:
+            return "time"
+        tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+        if self.max_tokens_total is not None and tokens >= self.max_tokens_total:
+            return "tokens"
+        if (
+            self.max_cost is not None
+            and estimate_cost(self.model, usage) >= self.max_cost
+        ):
+            return "cost"
+        return None
+
+    def status(self, usage):
+        """Remaining budget as a suffix for tool results ("" when unlimited)."""
+        parts = []
+        if self.end is not None:
+            parts.append(f"{self.time_left():.1f}s")
+        if self.max_tokens_total is not None:
+            tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+            parts.append(f"{max(0, self.max_tokens_total - tokens):,} tokens")
+        if self.max_cost is not None:
+            left = max(0.0, self.max_cost - estimate_cost(self.model, usage))
+            parts.append(f"${left:.4f}")
+        return f"\n[Budget left: {', '.join(parts)}]" if parts else ""
+
+
+_NO_USAGE = {"prompt_tokens": 0, "completion_tokens": 0}
+
+CONTEXT_PROFILE_PROMPT = """Precomputed profile of `context` (no need to re-check its type, size or samples):
+{profile}
+
+{query}"""
+
+BUDGET_EXHAUSTED_PROMPT = "Your {limit} budget is used up. Do not call any more tools: reply now with your best final answer based on what you have found so far."
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    """tiktoken encoding for model, or None when tiktoken or its data is unavailable."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Count tokens with tiktoken if available, else estimate from a sample."""
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    sample = text if len(text) <= 100_000 else text[:50_000] + text[-50_000:]
+    if not sample:
+        return 0
+    return round(len(_TOKEN_PIECE_RE.findall(sample)) * len(text) / len(sample))
+
+
+def elide(text, max_tokens, model="gpt-4o-mini"):
+    """Fit text into max_tokens by keeping its head and tail, cut on line breaks."""
+    tokens = count_tokens(text, model)
+    if tokens <= max_tokens:
+        return text
+    chars_per_token = len(text) / tokens
+    head_chars = int(max_tokens * 2 / 3 * chars_per_token)
+    tail_chars = int(max_tokens / 3 * chars_per_token)
+    head, tail = text[:head_chars], text[len(text) - tail_chars :]
+    # Prefer whole lines unless that would throw away most of the kept text
+    cut = head.rfind("\n")
+    if cut > head_chars // 2:
+        head = head[: cut + 1]
+    cut = tail.find("\n")
+    if -1 < cut < tail_chars // 2:
+        tail = tail[cut + 1 :]
+    omitted = text[len(head) : len(text) - len(tail)]
+    return (
+        f"{head}\n... (truncated {count_tokens(omitted, model)} tokens, "
+        f"{len(omitted)} chars, {omitted.count(chr(10))} lines) ...\n{tail}"
+    )
+
+
+CHUNK_BOUNDARIES = ("paragraph", "line", "record")
+_PARAGRAPH_END_RE = re.compile(r"\n[ \t]*\n\s*")
+
+
+class _Chunk:
+    """A planned slice of context: offsets (items for a list) and a token count.
+
+    ``text`` slices context only when read, so a plan holds no copies.
+    """
+
+    __slots__ = ("source", "start", "end", "tokens")
+
+    def __init__(self, source, start, end, tokens):
+        self.source, self.start, self.end, self.tokens = source, start, end, tokens
+
+    @property
+    def text(self):
+        return self.source[self.start : self.end]
+
+    def __str__(self):
+        text = self.text
+        return text if isinstance(text, str) else json.dumps(text, default=str)
+
+    def __repr__(self):
+        return f"Chunk(start={self.start}, end={self.end}, tokens={self.tokens})"
+
+
+def _chunk_units(context, boundary, max_tokens, model):
+    """(start, end, tokens) of the smallest pieces a chunk may be cut between."""
+    if isinstance(context, list):
+        return [
+            (i, i + 1, count_tokens(json.dumps(item, default=str), model))
+            for i, item in enumerate(context)
+        ]
+    # Records of a text context are its lines (JSON lines, CSV rows, log entries)
+    pattern = _PARAGRAPH_END_RE if boundary == "paragraph" else re.compile("\n")
+    ends = [m.end() for m in pattern.finditer(context)]
+    if not ends or ends[-1] != len(context):
+        ends.append(len(context))
+    units, start = [], 0
+    for end in ends:
+        if end == start:
+            continue
+        tokens = count_tokens(context[start:end], model)
+        # Split a piece too big for any chunk into near-equal parts on whitespace
+        parts = -(-tokens // max_tokens)
+        while parts > 1:
+            size = -(-(end - start) // parts)
+            cut = max(
+                context.rfind(" ", start, start + size),
+                context.rfind("\n", start, start + size),
+            )
+            cut = cut + 1 if cut > start + size // 2 else start + size
+            part_tokens = count_tokens(context[start:cut], model)
+            units.append((start, cut, part_tokens))
+            start, tokens, parts = cut, tokens - part_tokens, parts - 1
+        units.append((start, end, tokens))
+        start = end
+    return units
+
+
+def _plan_chunks(
+    state, plans, default_model, max_tokens, overlap=0, boundary="paragraph", model=None
+):
+    context = state.get("context")
+    if not isinstance(context, (str, list)):
+        raise TypeError("plan_chunks needs a string or list `context`")
+    if boundary not in CHUNK_BOUNDARIES:
+        raise ValueError(f"boundary must be one of {', '.join(CHUNK_BOUNDARIES)}")
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("need 0 <= overlap < max_tokens")
+    model = model or default_model
+    key = (max_tokens, overlap, boundary, model)
+    cached = plans.get(key)
+    # A context version is its identity and length: appends change either
+    if cached is not None and cached[0] is context and cached[1] == len(context):
+        plans.move_to_end(key)
+        return list(cached[2])
+    units = _chunk_units(context, boundary, max_tokens, model)
+    chunks, i = [], 0
+    while i < len(units):
+        j, total = i, 0
+        while j < len(units) and (j == i or total + units[j][2] <= max_tokens):
+            total += units[j][2]
+            j += 1
+        chunks.append(_Chunk(context, units[i][0], units[j - 1][1], total))
+        if j == len(units):
+            break
+        # Start the next chunk overlap tokens back, on a unit boundary
+        k, back = j, 0
+        while k - 1 > i and back + units[k - 1][2] <= overlap:
+            k -= 1
+            back += units[k][2]
+        i = k
+    plans[key] = (context, len(context), chunks)
+    if len(plans) > 8:
+        plans.popitem(last=False)
+    return list(chunks)
+
+
+def _summarize(value, limit=300):
+    """Short description of a value: type, length and a truncated repr."""
+    text = repr(value)
+    if len(text) > limit:
+        text = text[:limit] + f"... ({len(text) - limit} more chars)"
+    try:
+        return f"{type(value).__name__} of length {len(value)}: {text}"
+    except TypeError:
+        return f"{type(value).__name__}: {text}"
+
+
+def _final(holder, value):
+    holder["value"] = value
+    print(f"[Final answer set: {_summarize(value)}]")
+
+
+def _final_var(state, holder, name):
+    if name not in state:
+        raise NameError(f"name '{name}' is not defined")
+    _final(holder, state[name])
+
+
+def _new_context(state, feed):
+    """Part of context appended since the previous cell started."""
+    context, mark = state.get("context"), feed["mark"]
+    if isinstance(context, dict):
+        return dict(list(context.items())[mark:])
+    return context[mark:] if context is not None else None
+
+
+SEARCH_MODES = ("literal", "regex", "terms")
+# search_context tool arguments and their types
+SEARCH_ARGS = {"pattern": str, "mode": str, "max_hits": int, "window": int}
+
+
+def _search_args(args):
+    """Validated search_context keyword arguments from a tool call's arguments."""
+    if not isinstance(args, dict):
+        raise ValueError("arguments must be a JSON object")
+    unknown = set(args) - set(SEARCH_ARGS)
+    if unknown:
+        raise ValueError(f"unknown arguments: {', '.join(sorted(unknown))}")
+    if not isinstance(args.get("pattern"), str):
+        raise ValueError("pattern must be a string")
+    kwargs = {}
+    for name, value in args.items():
+        if SEARCH_ARGS[name] is int:
+            try:
+                if isinstance(value, bool):
+                    raise TypeError
+                value = int(value)
+            except (TypeError, ValueError, OverflowError):
+                raise ValueError(f"{name} must be an integer") from None
+        elif not isinstance(value, str):
+            raise ValueError(f"{name} must be a string")
+        kwargs[name] = value
+    return kwargs
+
+
+class _ContextIndex:
+    """Line-start offsets over a context's text, for mapping matches to lines."""
+
+    def __init__(self, text, source=None):
+        self.text = text
+        self.source = text if source is None else source
+        self.line_starts = array.array("q", [0])
+        self.line_starts.extend(m.end() for m in re.finditer("\n", text))
+
+    def extend(self, text):
+        """Index the part of text beyond the current text, which it must extend."""
+        base = len(self.text)
+        self.line_starts.extend(base + m.end() for m in re.finditer("\n", text[base:]))
+        self.text = self.source = text
+
+    def line_of(self, offset):
+        return bisect.bisect_right(self.line_starts, offset) - 1
+
+    def line(self, n):
+        start = self.line_starts[n]
+        end = (
+            self.line_starts[n + 1] - 1
+            if n + 1 < len(self.line_starts)
+            else len(self.text)
+        )
+        return self.text[start:end]
+
+    def search(self, pattern, mode="literal", max_hits=20, window=1, width=200):
+        """Compact, ranked hit windows for pattern as text."""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"mode must be one of {', '.join(SEARCH_MODES)}")
+        if mode == "terms":
+            terms = sorted({t.lower() for t in pattern.split()}, key=len, reverse=True)
+            regex = re.compile("|".join(map(re.escape, terms)), re.IGNORECASE)
+        else:
+            # ^ and $ match at line boundaries, as in grep
+            regex = re.compile(
+                re.escape(pattern) if mode == "literal" else pattern,
+                re.IGNORECASE if mode == "literal" else re.MULTILINE,
+            )
+        # line -> (first match offset, number of matches, distinct terms)
+        lines = {}
+        for m in regex.finditer(self.text):
+            if m.end() == m.start():
+                continue
+            n = self.line_of(m.start())
+            first, count, seen = lines.get(n, (m.start(), 0, set()))
+            seen.add(m.group(0).lower())
+            lines[n] = (first, count + 1, seen)
+        if mode == "terms":
+            # Rank by distinct terms in the hit's window, then by match count
+            scores = {}
+            for n, (_, count, _) in lines.items():
+                seen = set()
+                for k in range(n - window, n + window + 1):
+                    if k in lines:
+                        seen |= lines[k][2]
+                scores[n] = (-len(seen), -count, n)
+            ranked = sorted(lines, key=scores.get)
+        else:
+            ranked = sorted(lines)
+        total = sum(count for _, count, _ in lines.values())
+        shown, covered = [], set()
+        for n in ranked:
+            if len(shown) == max_hits:
+                break
+            if n in covered:
+                continue
+            covered.update(range(n - window, n + window + 1))
+            shown.append(n)
+        out = [
+            f"{total} matches on {len(lines)} lines for {pattern!r} ({mode}); "
+            f"showing {len(shown)}"
+        ]
+        for n in shown:
+            first = lines[n][0]
+            out.append(f"[line {n + 1}, offset {first}]")
+            for k in range(
+                max(0, n - window), min(len(self.line_starts), n + window + 1)
+            ):
+                text = self.line(k)
+                if len(text) > width:
+                    # Centre long lines on the match
+                    col = first - self.line_starts[k] if k == n else 0
+                    begin = max(0, min(col - width // 2, len(text) - width))
+                    more = "..." if begin + width < len(text) else ""
+                    text = ("..." if begin else "") + text[begin : begin + width] + more
+                out.append(f"{'>' if k == n else ' '} {k + 1}| {text}")
+        return "\n".join(out)
+
+
+# Cells touching these are never memoized: their results depend on the
+# outside world, the clock, randomness, or they have side effects.
+IMPURE_MODULES = frozenset(
+    {
+        "datetime",
+        "glob",
+        "http",
+        "io",
+        "multiprocessing",
+        "os",
+        "pathlib",
+        "random",
+        "requests",
+        "secrets",
+        "shutil",
+        "signal",
+        "socket",
+        "subprocess",
+        "sys",
+        "tempfile",
+        "threading",
+        "time",
+        "urllib",
+        "uuid",
+    }
+)
+# Helpers that read `context` without naming it in the cell
+CONTEXT_HELPERS = frozenset({"plan_chunks", "pmap", "pscan"})
+IMPURE_NAMES = frozenset(
+    {
+        "FINAL_VAR",
+        "__import__",
+        "_stderr",
+        "_stdout",
+        "delattr",
+        "dir",
+        "final",
+        "globals",
+        "id",
+        "input",
+        "iter",
+        "locals",
+        "memory_usage",
+        "new_context",
+        "next",
+        "open",
+        "setattr",
+        "vars",
+    }
+)
+# Method calls on these cannot change the receiver's value
+_UNMUTATED_TYPES = (
+    str,
+    bytes,
+    int,
+    float,
+    complex,
+    bool,
+    type(None),
+    tuple,
+    frozenset,
+    range,
+    types.ModuleType,
+)
+# Builtins that never mutate their arguments
+_NONMUTATING_CALLS = frozenset({"isinstance", "len", "print", "repr", "str", "type"})
+_GLOBAL_STORES = {dis.opmap["STORE_GLOBAL"], dis.opmap["DELETE_GLOBAL"]}
+
+
+def _root_name(expr):
+    while isinstance(expr, (ast.Attribute, ast.Subscript, ast.Call)):
+        expr = expr.func if isinstance(expr, ast.Call) else expr.value
+    return expr.id if isinstance(expr, ast.Name) else None
+
+
+class _CellAnalyzer(ast.NodeVisitor):
+    """Static read/write sets of a cell's global names.
+
+    Reads are names loaded before the cell binds them. Anything the cell may
+    mutate in place (method call receivers, call arguments, subscript and
+    attribute targets) counts as both read and written. Function and lambda bodies are skipped:
+    their global reads are resolved when the function is called.
+    """
+
+    def __init__(self):
+        self.reads, self.writes = set(), set()
+        self.receivers = set()  # receivers and arguments, mutated only if mutable
+        self.scopes = []  # comprehension-local names
+        self.pure = True
+
+    def _read(self, name):
+        if name not in self.writes and not any(name in s for s in self.scopes):
+            self.reads.add(name)
+
+    def _mutate(self, expr, into=None):
+        name = _root_name(expr)
+        if name and not any(name in s for s in self.scopes):
+            self._read(name)
+            (self.writes if into is None else into).add(name)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self._read(node.id)
+        elif isinstance(node.ctx, ast.Store):
+            (self.scopes[-1] if self.scopes else self.writes).add(node.id)
+        else:
+            self.pure = False
+
+    def visit_Assign(self, node):
+        self.visit(node.value)
+        for target in node.targets:
+            self.visit(target)
+
+    def visit_AnnAssign(self, node):
+        if node.value is not None:
+            self.visit(node.value)
+        self.visit(node.target)
+
+    def visit_AugAssign(self, node):
+        self.visit(node.value)
+        self._mutate(node.target)
+        self.generic_visit(node.target)
+
+    def _visit_target(self, node):
+        if isinstance(node.ctx, ast.Del):
+            self.pure = False
+        if not isinstance(node.ctx, ast.Load):
+            self._mutate(node.value)
+        self.generic_visit(node)
+
+    visit_Attribute = visit_Subscript = _visit_target
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Attribute):
+            self._mutate(node.func.value, self.receivers)
+        if not (isinstance(node.func, ast.Name) and node.func.id in _NONMUTATING_CALLS):
+            # The callee may mutate what it is passed (heapq.heappush(h, x))
+            for arg in node.args + [k.value for k in node.keywords]:
+                arg = arg.value if isinstance(arg, ast.Starred) else arg
+                if isinstance(arg, (ast.Name, ast.Attribute, ast.Subscript)):
+                    self._mutate(arg, self.receivers)
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        for expr in node.decorator_list + node.args.defaults + node.args.kw_defaults:
+            if expr is not None:
+                self.visit(expr)
+        self.writes.add(node.name)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        for expr in node.args.defaults + node.args.kw_defaults:
+            if expr is not None:
+                self.visit(expr)
+
+    def _visit_comprehension(self, node, *elements):
+        self.scopes.append(set())
+        for gen in node.generators:
+            self.visit(gen.iter)
+            self.visit(gen.target)
+            for cond in gen.ifs:
+                self.visit(cond)
+        for element in elements:
+            self.visit(element)
+        self.scopes.pop()
+
+    def visit_ListComp(self, node):
+        self._visit_comprehension(node, node.elt)
+
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._visit_comprehension(node, node.key, node.value)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            root = alias.name.split(".")[0]
+            self.writes.add(alias.asname or root)
+            if root in IMPURE_MODULES:
+                self.pure = False
+
+    def visit_ImportFrom(self, node):
+        if (node.module or "").split(".")[0] in IMPURE_MODULES or node.level:
+            self.pure = False
+        for alias in node.names:
+            if alias.name == "*":
+                self.pure = False
+            self.writes.add(alias.asname or alias.name)
+
+    def _impure(self, node):
+        self.pure = False
+
+    visit_Global = visit_Nonlocal = visit_Await = visit_Yield = _impure
+    visit_YieldFrom = visit_Delete = _impure
+
+
+def _code_objects(code):
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _code_objects(const)
+
+
+class _CellMemo:
+    """Cache of deterministic cells, keyed on code and input-variable versions.
+
+    Every global name carries a version that is bumped whenever a cell may
+    have rebound or mutated it. A cell whose code and input versions match an
+    earlier successful run gets that run's output and written variables back
+    instead of executing. Cached objects that are later mutated in place
+    invalidate the entries holding them.
+    """
+
+    def __init__(self, state, max_entries=128):
+        self.state = state
+        self.max_entries = max_entries
+        self.versions = {}
+        self.clock = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+
+    def _tracked(self):
+        return {
+            k: id(v)
+            for k, v in dict.items(self.state)
+            if k != "__builtins__" and v is not self.state.helpers.get(k)
+        }
+
+    def _lookup(self, name):
+        if dict.__contains__(self.state, name):
+            return dict.__getitem__(self.state, name)
+        return self.state["__builtins__"].get(name)
+
+    def _expand(self, reads):
+        """Add globals read by called REPL functions; False if any input is impure."""
+        pending, reads = list(reads), set(reads)
+        while pending:
+            name = pending.pop()
+            if name in IMPURE_NAMES:
+                return False
+            if name in CONTEXT_HELPERS and "context" not in reads:
+                reads.add("context")
+                pending.append("context")
+            value = self._lookup(name)
+            module = getattr(value, "__module__", None) or getattr(
+                value, "__name__", ""
+            )
+            if isinstance(value, types.ModuleType):
+                module = value.__name__
+            if isinstance(module, str) and module.split(".")[0] in IMPURE_MODULES:
+                return False
+            if hasattr(value, "__next__"):
+                return False
+            if (
+                isinstance(value, types.FunctionType)
+                and value.__globals__ is self.state
+            ):
+                for code in _code_objects(value.__code__):
+                    if any(
+                        i.opcode in _GLOBAL_STORES for i in dis.get_instructions(code)
+                    ):
+                        return False
+                    for ref in code.co_names:
+                        if ref in reads or not dict.__contains__(self.state, ref):
+                            continue
+                        if isinstance(
+                            dict.__getitem__(self.state, ref),
+                            (list, dict, set, bytearray),
+                        ):
+                            return False
+                        reads.add(ref)
+                        pending.append(ref)
+            elif type(value).__module__ == "__main__" or (
+                isinstance(value, type) and value.__module__ == "__main__"
+            ):
+                # Instances and classes defined in the REPL run arbitrary code
+                return False
+        return reads
+
+    def prepare(self, code):
+        """Analyze a cell before it runs; returns the cell's memo record."""
+        cell = types.SimpleNamespace(
+            key=None, writes=None, entry=None, before=self._tracked()
+        )
+        if _MAGIC_RE.match(code):
+            return cell
+        try:
+            analyzer = _CellAnalyzer()
+            analyzer.visit(ast.parse(code))
+        except SyntaxError:
+            return cell
+        cell.writes = analyzer.writes | {
+            n
+            for n in analyzer.receivers - analyzer.writes
+            if not isinstance(self._lookup(n), _UNMUTATED_TYPES)
+        }
+        reads = analyzer.pure and self._expand(analyzer.reads)
+        if reads:
+            cell.key = (code, tuple((n, self.versions.get(n)) for n in sorted(reads)))
+            cell.entry = self.entries.get(cell.key)
+            if cell.entry is not None:
+                self.entries.move_to_end(cell.key)
+        return cell
+
+    def restore(self, entry):
+        for name, (value, version) in entry.written.items():
+            self.state[name] = value
+            self.versions[name] = version
+        self.hits += 1
+        sys.stdout.write(entry.stdout)
+
+    def invalidate(self, *names):
+        """Mark names as changed outside of cells (e.g. an appended context)."""
+        self._bump(names)
+
+    def _bump(self, names):
+        self.clock += 1
+        for name in names:
+            self.versions[name] = self.clock
+
+    def finish(self, cell, stdout, error):
+        """Record what a cell changed and cache it if it was memoizable."""
+        if cell.entry is not None:
+            return
+        after = self._tracked()
+        changed = {
+            n
+            for n in cell.before.keys() | after.keys()
+            if cell.before.get(n) != after.get(n)
+        }
+        maybe_mutated = (
+            set(cell.before) if cell.writes is None else cell.writes & set(after)
+        ) - changed
+        if maybe_mutated:
+            mutated = {after[n] for n in maybe_mutated}
+            for key in [
+                key
+                for key, entry in self.entries.items()
+                if any(id(value) in mutated for value, _ in entry.written.values())
+            ]:
+                del self.entries[key]
+        self._bump(changed | maybe_mutated)
+        if cell.key is not None and not error:
+            written = {
+                n: (dict.__getitem__(self.state, n), self.versions[n])
+                for n in cell.writes
+                if dict.__contains__(self.state, n)
+            }
+            self.entries[cell.key] = types.SimpleNamespace(
+                stdout=stdout, written=written
+            )
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+# Texts longer than this get word and byte counts estimated from a sample
+PROFILE_EXACT_LIMIT = 10_000_000
+PROFILE_SAMPLE_CHARS = 400
+
+
+def _sample(text, start, n=PROFILE_SAMPLE_CHARS):
+    """About n chars of text from start, widened to whole lines when cheap."""
+    if start > 0:
+        newline = text.find("\n", start, start + n // 2)
+        start = newline + 1 if newline != -1 else start
+    chunk = text[start : start + n]
+    newline = chunk.rfind("\n")
+    return chunk[:newline] if newline > n // 2 else chunk
+
+
+def _schema(obj, depth=0, max_keys=15):
+    """Small structural sketch of JSON-like data: keys, element types, lengths."""
+    if isinstance(obj, dict):
+        if depth >= 3:
+            return f"dict[{len(obj)} keys]"
+        sketch = {k: _schema(v, depth + 1) for k, v in list(obj.items())[:max_keys]}
+        if len(obj) > max_keys:
+            sketch["..."] = f"{len(obj) - max_keys} more keys"
+        return sketch
+    if isinstance(obj, list):
+        if not obj:
+            return "list[0]"
+        if depth >= 3:
+            return f"list[{len(obj)}]"
+        return {f"list[{len(obj)}] of": _schema(obj[0], depth + 1)}
+    return type(obj).__name__
+
+
+def _text_format(text):
+    lines = text[:20_000].splitlines()[:10]
+    if not lines:
+        return "empty"
+    if all(line.lstrip().startswith("{") for line in lines if line.strip()):
+        return "JSON lines"
+    for sep, name in ((",", "CSV"), ("\t", "TSV")):
+        counts = {line.count(sep) for line in lines if line.strip()}
+        if len(counts) == 1 and counts.pop() > 0:
+            return f"{name} ({lines[0].count(sep) + 1} columns)"
+    return "text"
+
+
+def profile_context(context, serialized=None):
+    """Compact description of a context: type, size, structure and samples.
+
+    ``serialized`` is the JSON text of a JSON context, if already available.
+    """
+    profile = {"type": type(context).__name__}
+    if isinstance(context, str):
+        n = len(context)
+        exact = n <= PROFILE_EXACT_LIMIT
+        sample = context if exact else context[: PROFILE_EXACT_LIMIT // 2]
+        ascii_ = context.isascii()
+        scale = n / max(1, len(sample))
+        short = n <= 3 * PROFILE_SAMPLE_CHARS
+        profile.update(
+            chars=n,
+            lines=context.count("\n") + (1 if n and not context.endswith("\n") else 0),
+            words=round(len(sample.split()) * scale),
+            bytes=n if ascii_ else round(len(sample.encode()) * scale),
+            encoding="ascii" if ascii_ else "utf-8 (non-ASCII)",
+            exact_counts=exact,
+            format=_text_format(context),
+            head=context if short else _sample(context, 0),
+            middle=None if short else _sample(context, n // 2),
+            tail=None if short else context[-PROFILE_SAMPLE_CHARS:],
+        )
+    else:
+        serialized = serialized or json.dumps(context, default=str)
+        profile.update(
+            bytes=len(serialized),
+            schema=_schema(context),
+            head=serialized[: 2 * PROFILE_SAMPLE_CHARS],
+            tail=(
+                serialized[-PROFILE_SAMPLE_CHARS:]
+                if len(serialized) > 3 * PROFILE_SAMPLE_CHARS
+                else None
+            ),
+        )
+        if isinstance(context, (list, dict)):
+            profile["items"] = len(context)
+    return profile
+
+
+def extend_profile(profile, context, data):
+    """Profile of context after data was appended to it, without a rescan.
+
+    Counts are updated from data alone; samples are re-read from context.
+    """
+    profile = dict(profile)
+    if isinstance(context, str):
+        n, old = len(context), profile["chars"]
+        last = context[old - 1] if old else "\n"
+        split = data.split()
+        short = n <= 3 * PROFILE_SAMPLE_CHARS
+        ascii_ = profile["encoding"] == "ascii" and data.isascii()
+        profile.update(
+            chars=n,
+            lines=profile["lines"]
+            - (last != "\n")
+            + data.count("\n")
+            + (1 if n and context[-1] != "\n" else 0),
+            # A word cut at the old end continues into data
+            words=profile["words"]
+            + len(split)
+            - bool(split and not last.isspace() and not data[0].isspace()),
+            bytes=profile["bytes"] + (len(data) if ascii_ else len(data.encode())),
+            encoding="ascii" if ascii_ else "utf-8 (non-ASCII)",
+            head=context if short else _sample(context, 0),
+            middle=None if short else _sample(context, n // 2),
+            tail=None if short else context[-PROFILE_SAMPLE_CHARS:],
+        )
+        if not old:
+            profile["format"] = _text_format(context)
+        return profile
+    piece = json.dumps(data, default=str)[1:-1]
+    sep = ", " if profile.get("items") and piece else ""
+    if profile["tail"] is None:
+        # Head still holds the whole serialization
+        text = profile["head"][:-1] + sep + piece + profile["head"][-1]
+        head, tail = text[: 2 * PROFILE_SAMPLE_CHARS], text[-PROFILE_SAMPLE_CHARS:]
+    else:
+        head = profile["head"]
+        tail = (profile["tail"][:-1] + sep + piece)[-PROFILE_SAMPLE_CHARS + 1 :]
+        tail += profile["tail"][-1]
+    nbytes = profile["bytes"] + len(sep) + len(piece)
+    profile.update(
+        bytes=nbytes,
+        head=head,
+        tail=tail if nbytes > 3 * PROFILE_SAMPLE_CHARS else None,
+        items=len(context),
+        schema=_schema(context),
+    )
+    return profile
+
+
+def format_profile(profile):
+    """Render a profile as the short text shown to the model."""
+    out = [f"type: {profile['type']}"]
+    if "chars" in profile:
+        approx = "" if profile["exact_counts"] else "~"
+        out.append(
+            f"size: {profile['chars']:,} chars, {profile['lines']:,} lines, "
+            f"{approx}{profile['words']:,} words, {approx}{profile['bytes']:,} bytes "
+            f"({profile['encoding']}); format: {profile['format']}"
+        )
+        samples = ("head", "middle", "tail")
+    else:
+        items = f", {profile['items']:,} top-level items" if "items" in profile else ""
+        out.append(f"size: {profile['bytes']:,} bytes as JSON{items}")
+        out.append(f"schema: {json.dumps(profile['schema'])}")
+        samples = ("head", "tail")
+    for name in samples:
+        if profile[name] is not None:
+            out.append(f"{name}:\n{profile[name]!r}")
+    return "\n".join(out)
+
+
+def _best_answer(messages):
+    """Latest assistant text in messages, for when there is no time to ask again."""
+    for message in reversed(messages):
+        if message["role"] == "assistant" and message.get("content"):
+            return message["content"]
+    return "Budget exhausted before the model produced an answer."
+
+
+def _deep_sizeof(obj, seen=None):
+    """Approximate memory held by obj, following containers and instance dicts."""
+    seen = set() if seen is None else seen
+    # An explicit stack, so deeply nested values cannot hit the recursion limit
+    size, stack = 0, [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(
+            obj, (type, types.ModuleType, types.FunctionType)
+        ):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            for item in list(obj.items()):
+                stack.extend(item)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(list(obj))
+        elif hasattr(obj, "__dict__"):
+            stack.append(vars(obj))
+    return size
+
+
+# Values smaller than this are never worth a round trip to disk
+SPILL_MIN_BYTES = 1 << 20
+
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_]\w*")
+_SCALAR_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+
+def _is_flat(value):
+    """True for scalars and for containers holding only scalars."""
+    if isinstance(value, _SCALAR_TYPES):
+        return True
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(isinstance(v, _SCALAR_TYPES) for v in value)
+    if isinstance(value, dict):
+        return all(
+            isinstance(k, _SCALAR_TYPES) and isinstance(v, _SCALAR_TYPES)
+            for k, v in value.items()
+        )
+    return False
+
+
+def _resident_bytes(usage):
+    return sum(v["bytes"] for v in usage.values() if not v["spilled"])
+
+
+class _Namespace(dict):
+    """REPL globals that can spill large cold values to disk.
+
+    Spilled names are absent from the dict itself; ``__missing__`` (which exec
+    consults for dict subclasses) unpickles them back on first access.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helpers = {}
+        self.spill_dir = None
+        self.spilled = {}  # name -> (path, bytes, type name)
+        self.sizes = {}  # name -> bytes, for values in memory
+        self._size_ids = {}  # name -> id of the value that was measured
+        self.last_used = {}  # name -> tick of the last cell mentioning it
+        self.tick = 0
+
+    def __missing__(self, name):
+        entry = self.spilled.pop(name, None)
+        if entry is None:
+            raise KeyError(name)
+        with open(entry[0], "rb") as f:
+            value = pickle.load(f)
+        os.remove(entry[0])
+        dict.__setitem__(self, name, value)
+        self.sizes[name], self._size_ids[name] = entry[1], id(value)
+        self.last_used[name] = self.tick
+        return value
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.spilled
+
+    def __delitem__(self, name):
+        entry = self.spilled.pop(name, None)
+        if entry is None:
+            dict.__delitem__(self, name)
+        else:
+            os.remove(entry[0])
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def user_names(self):
+        return [
+            k
+            for k, v in self.items()
+            if not k.startswith("_")
+            and k != "__builtins__"
+            and v is not self.helpers.get(k)
+        ]
+
+    def account(self, code):
+        """Update per-variable deep sizes after a cell, re-measuring what it touched."""
+        self.tick += 1
+        touched = set(_IDENTIFIER_RE.findall(code))
+        names = self.user_names()
+        for name in names:
+            value = dict.__getitem__(self, name)
+            if name in self.spilled:  # Re-assigned while spilled
+                os.remove(self.spilled.pop(name)[0])
+            if name in touched:
+                self.last_used[name] = self.tick
+            if name in touched or self._size_ids.get(name) != id(value):
+                self.sizes[name] = _deep_sizeof(value)
+                self._size_ids[name] = id(value)
+        for name in set(self.sizes) - set(names):
+            del self.sizes[name], self._size_ids[name]
+
+    def spill(self, limit):
+        """Pickle least recently used large values to disk until under limit."""
+        total = sum(self.sizes.values())
+        if total <= limit:
+            return
+        candidates = sorted(
+            self.sizes, key=lambda n: (self.last_used.get(n, 0), -self.sizes[n])
+        )
+        for name in candidates:
+            if total <= limit:
+                break
+            value = dict.__getitem__(self, name)
+            # Only flat values held solely by the namespace: spilling anything
+            # that shares objects would free nothing and split one object into
+            # two on reload.
+            if (
+                self.sizes[name] < SPILL_MIN_BYTES
+                or sys.getrefcount(value) > 3
+                or not _is_flat(value)
+            ):
+                continue
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, f"{name}.pkl")
+            try:
+                with open(path, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            size = self.sizes.pop(name)
+            del self._size_ids[name]
+            self.spilled[name] = (path, size, type(value).__name__)
+            dict.__delitem__(self, name)
+            total -= size
+
+    def memory_usage(self):
+        """Deep size, type and location of every variable, largest first."""
+        usage = {
+            name: {
+                "bytes": self.sizes.get(name)
+                or _deep_sizeof(dict.__getitem__(self, name)),
+                "type": type(dict.__getitem__(self, name)).__name__,
+                "spilled": False,
+            }
+            for name in self.user_names()
+        }
+        for name, (path, size, type_name) in self.spilled.items():
+            usage[name] = {"bytes": size, "type": type_name, "spilled": True}
+        return dict(sorted(usage.items(), key=lambda kv: -kv[1]["bytes"]))
+
+
+TRANSCRIPT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL,
+    iterations INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    role TEXT NOT NULL,
+    content TEXT,
+    tool_calls TEXT,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS completions (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    duration REAL NOT NULL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tool_calls (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    call_id TEXT,
+    name TEXT NOT NULL,
+    arguments TEXT,
+    code TEXT,
+    result TEXT,
+    duration REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_model ON sessions(model, started);
+CREATE INDEX IF NOT EXISTS idx_sessions_started ON sessions(started);
+CREATE INDEX IF NOT EXISTS idx_sessions_iterations ON sessions(iterations);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+CREATE INDEX IF NOT EXISTS idx_completions_session ON completions(session_id);
+CREATE INDEX IF NOT EXISTS idx_tool_calls_session ON tool_calls(session_id, id);
+CREATE INDEX IF NOT EXISTS idx_tool_calls_created ON tool_calls(created, duration);
+"""
+
+
+class TranscriptStore:
+    """Append-only sqlite log of chat sessions, shared by any number of agents."""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(TRANSCRIPT_SCHEMA)
+
+    def _write(self, sql, params):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).lastrowid
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def start_session(self, model):
+        return self._write(
+            "INSERT INTO sessions (model, started) VALUES (?, ?)", (model, time.time())
+        )
+
+    def end_session(self, session_id, iterations):
+        self._write(
+            "UPDATE sessions SET ended = ?, iterations = ? WHERE id = ?",
+            (time.time(), iterations, session_id),
+        )
+
+    def add_message(self, session_id, message):
+        tool_calls = message.get("tool_calls")
+        self._write(
+            "INSERT INTO messages (session_id, role, content, tool_calls, created)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                session_id,
+                message["role"],
+                message.get("content"),
+                json.dumps(tool_calls) if tool_calls else None,
+                time.time(),
+            ),
+        )
+
+    def add_completion(self, session_id, duration, usage=None):
+        prompt = getattr(usage, "prompt_tokens", None)
+        completion = getattr(usage, "completion_tokens", None)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO completions (session_id, duration, prompt_tokens,"
+                " completion_tokens, created) VALUES (?, ?, ?, ?, ?)",
+                (session_id, duration, prompt, completion, time.time()),
+            )
+            self.conn.execute(
+                "UPDATE sessions SET prompt_tokens = prompt_tokens + ?,"
+                " completion_tokens = completion_tokens + ? WHERE id = ?",
+                (prompt or 0, completion or 0, session_id),
+            )
+
+    def add_tool_call(self, session_id, call_id, name, arguments, result, duration):
+        self._write(
+            "INSERT INTO tool_calls (session_id, call_id, name, arguments, code,"
+            " result, duration, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                session_id,
+                call_id,
+                name,
+                json.dumps(arguments),
+                arguments.get("code") if isinstance(arguments, dict) else None,
+                result,
+                duration,
+                time.time(),
+            ),
+        )
+
+    def sessions(self, model=None, since=None, min_iterations=None, limit=None):
+        """Sessions newest first, optionally filtered by model, start time and length."""
+        sql, params = "SELECT * FROM sessions WHERE 1 = 1", []
+        if model is not None:
+            sql += " AND model = ?"
+            params.append(model)
+        if since is not None:
+            sql += " AND started >= ?"
+            params.append(since)
+        if min_iterations is not None:
+            sql += " AND iterations >= ?"
+            params.append(min_iterations)
+        sql += " ORDER BY started DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._query(sql, params)
+
+    def slowest_calls(self, since=None, limit=10):
+        """Slowest tool calls (e.g. REPL cells), optionally since a timestamp."""
+        return self._query(
+            "SELECT * FROM tool_calls WHERE created >= ? ORDER BY duration DESC LIMIT ?",
+            (since or 0, limit),
+        )
+
+    def messages(self, session_id):
+        rows = self._query(
+            "SELECT * FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+        )
+        for row in rows:
+            if row["tool_calls"]:
+                row["tool_calls"] = json.loads(row["tool_calls"])
+        return rows
+
+    def tool_calls(self, session_id):
+        rows = self._query(
+            "SELECT * FROM tool_calls WHERE session_id = ? ORDER BY id", (session_id,)
+        )
+        for row in rows:
+            row["arguments"] = json.loads(row["arguments"])
+        return rows
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
 
 class REPLAgent:
-    def __init__(self, model="gpt-4o-mini", setup_code=None):
+    def __init__(
+        self,
+        model="gpt-4o-mini",
+        setup_code=None,
+        transcript=None,
+        max_output_tokens=None,
+        scratch_quota=None,
+        scratch_in_memory=False,
+        memory_limit=None,
+        memoize=False,
+        registry=None,
+    ):
         # Auto-detect provider from model name
         if model.startswith("gemini-") or model.startswith("models/gemini-"):
             # Gemini via OpenAI compatibility layer
@@ -29,119 +1544,166 @@ class REPLAgent:
             # Default to OpenAI
             self.client = OpenAI()
         self.model = model
+        # Optional transcript store (a TranscriptStore or a sqlite path)
+        self.transcript = (
+            TranscriptStore(transcript) if isinstance(transcript, str) else transcript
+        )
+        self.session_id = None
+        # Token budget for each cell's output; chat() lowers output_budget as
+        # the conversation approaches the model's context window.
+        self.context_window = context_window_for(model)
+        self.max_output_tokens = max_output_tokens or min(
+            4000, max(500, self.context_window // 256)
+        )
+        self.output_budget = self.max_output_tokens
         # Initialize state with restricted built-ins for security
-        self.state = {
-            "__name__": "__main__",  # Required for class definitions
-            "__builtins__": {
-                # Safe built-ins for string manipulation
-                "print": print,
-                "len": len,
-                "str": str,
-                "int": int,
-                "float": float,
-                "list": list,
-                "dict": dict,
-                "set": set,
-                "tuple": tuple,
-                "bool": bool,
-                "type": type,
-                "isinstance": isinstance,
-                "enumerate": enumerate,
-                "zip": zip,
-                "map": map,
-                "filter": filter,
-                "sorted": sorted,
-                "min": min,
-                "max": max,
-                "sum": sum,
-                "abs": abs,
-                "round": round,
-                "chr": chr,
-                "ord": ord,
-                "hex": hex,
-                "bin": bin,
-                "oct": oct,
-                "repr": repr,
-                "ascii": ascii,
-                "format": format,
-                "__import__": __import__,  # Allow imports
-                "__build_class__": __build_class__,  # Allow class definitions
-                "open": open,  # Allow file access
-                # Add commonly used built-ins that were missing
-                "any": any,
-                "all": all,
-                "hasattr": hasattr,
-                "getattr": getattr,
-                "setattr": setattr,
-                "delattr": delattr,
-                "dir": dir,
-                "vars": vars,
-                "range": range,  # Add range function
-                "reversed": reversed,  # Add reversed function
-                "slice": slice,  # Add slice function
-                "iter": iter,  # Add iter function
-                "next": next,  # Add next function
-                "pow": pow,  # Add pow function
-                "divmod": divmod,  # Add divmod function
-                "complex": complex,  # Add complex function
-                "bytes": bytes,  # Add bytes function
-                "bytearray": bytearray,  # Add bytearray function
-                "memoryview": memoryview,  # Add memoryview function
-                "hash": hash,  # Add hash function
-                "id": id,  # Add id function
-                "callable": callable,  # Add callable function
-                "issubclass": issubclass,  # Add issubclass function
-                "super": super,  # Add super function
-                "property": property,  # Add property function
-                "staticmethod": staticmethod,  # Add staticmethod function
-                "classmethod": classmethod,  # Add classmethod function
-                "object": object,  # Add object class
-                # Add exception classes
-                "Exception": Exception,
-                "ValueError": ValueError,
-                "TypeError": TypeError,
-                "KeyError": KeyError,
-                "IndexError": IndexError,
-                "AttributeError": AttributeError,
-                "FileNotFoundError": FileNotFoundError,
-                "OSError": OSError,
-                "IOError": IOError,
-                "RuntimeError": RuntimeError,
-                "NameError": NameError,
-                "ImportError": ImportError,
-                "StopIteration": StopIteration,
-                "GeneratorExit": GeneratorExit,
-                "SystemExit": SystemExit,
-                "KeyboardInterrupt": KeyboardInterrupt,
-                "BaseException": BaseException,
-                "ArithmeticError": ArithmeticError,
-                "LookupError": LookupError,
-                "AssertionError": AssertionError,
-                "NotImplementedError": NotImplementedError,
-                "UnicodeError": UnicodeError,
-                "Warning": Warning,
-                "UserWarning": UserWarning,
-                "DeprecationWarning": DeprecationWarning,
-                "SyntaxWarning": SyntaxWarning,
-                "RuntimeWarning": RuntimeWarning,
-                "FutureWarning": FutureWarning,
-                "ImportWarning": ImportWarning,
-                "UnicodeWarning": UnicodeWarning,
-                "BytesWarning": BytesWarning,
-                "ResourceWarning": ResourceWarning,
-                "ZeroDivisionError": ZeroDivisionError,
-                "SyntaxError": SyntaxError,
-                # Block dangerous built-ins
-                "input": None,  # Block input
-                "eval": None,  # Block eval
-                "exec": None,  # Block exec
-                "compile": None,  # Block compile
-                "globals": None,  # Block globals access
-                "locals": None,  # Block locals access
-            },
+        self.state = _Namespace(
+            {
+                "__name__": "__main__",  # Required for class definitions
+                "__builtins__": {
+                    # Safe built-ins for string manipulation
+                    "print": print,
+                    "len": len,
+                    "str": str,
+                    "int": int,
+                    "float": float,
+                    "list": list,
+                    "dict": dict,
+                    "set": set,
+                    "tuple": tuple,
+                    "bool": bool,
+                    "type": type,
+                    "isinstance": isinstance,
+                    "enumerate": enumerate,
+                    "zip": zip,
+                    "map": map,
+                    "filter": filter,
+                    "sorted": sorted,
+                    "min": min,
+                    "max": max,
+                    "sum": sum,
+                    "abs": abs,
+                    "round": round,
+                    "chr": chr,
+                    "ord": ord,
+                    "hex": hex,
+                    "bin": bin,
+                    "oct": oct,
+                    "repr": repr,
+                    "ascii": ascii,
+                    "format": format,
+                    "__import__": __import__,  # Allow imports
+                    "__build_class__": __build_class__,  # Allow class definitions
+                    "open": open,  # Allow file access
+                    # Add commonly used built-ins that were missing
+                    "any": any,
+                    "all": all,
+                    "hasattr": hasattr,
+                    "getattr": getattr,
+                    "setattr": setattr,
+                    "delattr": delattr,
+                    "dir": dir,
+                    "vars": vars,
+                    "range": range,  # Add range function
+                    "reversed": reversed,  # Add reversed function
+                    "slice": slice,  # Add slice function
+                    "iter": iter,  # Add iter function
+                    "next": next,  # Add next function
+                    "pow": pow,  # Add pow function
+                    "divmod": divmod,  # Add divmod function
+                    "complex": complex,  # Add complex function
+                    "bytes": bytes,  # Add bytes function
+                    "bytearray": bytearray,  # Add bytearray function
+                    "memoryview": memoryview,  # Add memoryview function
+                    "hash": hash,  # Add hash function
+                    "id": id,  # Add id function
+                    "callable": callable,  # Add callable function
+                    "issubclass": issubclass,  # Add issubclass function
+                    "super": super,  # Add super function
+                    "property": property,  # Add property function
+                    "staticmethod": staticmethod,  # Add staticmethod function
+                    "classmethod": classmethod,  # Add classmethod function
+                    "object": object,  # Add object class
+                    # Add exception classes
+                    "Exception": Exception,
+                    "ValueError": ValueError,
+                    "TypeError": TypeError,
+                    "KeyError": KeyError,
+                    "IndexError": IndexError,
+                    "AttributeError": AttributeError,
+                    "FileNotFoundError": FileNotFoundError,
+                    "OSError": OSError,
+                    "IOError": IOError,
+                    "RuntimeError": RuntimeError,
+                    "NameError": NameError,
+                    "ImportError": ImportError,
+                    "StopIteration": StopIteration,
+                    "GeneratorExit": GeneratorExit,
+                    "SystemExit": SystemExit,
+                    "KeyboardInterrupt": KeyboardInterrupt,
+                    "BaseException": BaseException,
+                    "ArithmeticError": ArithmeticError,
+                    "LookupError": LookupError,
+                    "AssertionError": AssertionError,
+                    "NotImplementedError": NotImplementedError,
+                    "UnicodeError": UnicodeError,
+                    "Warning": Warning,
+                    "UserWarning": UserWarning,
+                    "DeprecationWarning": DeprecationWarning,
+                    "SyntaxWarning": SyntaxWarning,
+                    "RuntimeWarning": RuntimeWarning,
+                    "FutureWarning": FutureWarning,
+                    "ImportWarning": ImportWarning,
+                    "UnicodeWarning": UnicodeWarning,
+                    "BytesWarning": BytesWarning,
+                    "ResourceWarning": ResourceWarning,
+                    "ZeroDivisionError": ZeroDivisionError,
+                    "SyntaxError": SyntaxError,
+                    # Block dangerous built-ins
+                    "input": None,  # Block input
+                    "eval": None,  # Block eval
+                    "exec": None,  # Block exec
+                    "compile": None,  # Block compile
+                    "globals": None,  # Block globals access
+                    "locals": None,  # Block locals access
+                },
+            }
+        )
+        # Set by final()/FINAL_VAR() from inside the REPL to end chat()
+        self._final = {}
+        # Length of context when the previous and the current cell started
+        self._feed = {"mark": 0, "seen": 0, "growing": False}
+        self._follow = None
+        self.final_answer = self.final_summary = None
+        # Helpers are bound to the namespace rather than to self, so the agent
+        # is not kept alive by a reference cycle through its own state.
+        self.helpers = {
+            "pmap": functools.partial(_pmap, self.state),
+            "pscan": functools.partial(_pscan, self.state),
+            "final": functools.partial(_final, self._final),
+            "FINAL_VAR": functools.partial(_final_var, self.state, self._final),
+            "memory_usage": self.state.memory_usage,
+            "new_context": functools.partial(_new_context, self.state, self._feed),
+            "plan_chunks": functools.partial(
+                _plan_chunks, self.state, OrderedDict(), model
+            ),
         }
-        self.temp_dir = tempfile.mkdtemp(prefix="repl_agent_")
+        self.state.update(self.helpers)
+        self.state.helpers = self.helpers
+        self.scratch = ScratchDir(quota=scratch_quota, in_memory=scratch_in_memory)
+        self.temp_dir = self.scratch.path
+        # Per-session ceiling on namespace memory; cold values beyond it are
+        # pickled to the scratch dir and transparently loaded on next access.
+        self.memory_limit = memory_limit
+        self.state.spill_dir = os.path.join(self.temp_dir, "spill")
+        # Opt-in reuse of results from identical deterministic cells
+        self.memo = _CellMemo(self.state) if memoize else None
+        self._context_index = None
+        self.context_profile = None
+        self.registry = registry or CONTEXT_REGISTRY
+        self._shared_context = self._shared_finalizer = None
         self.last_messages = []
+        self.last_usage = {"prompt_tokens": 0, "completion_tokens": 0}
         self.tools = [
             {
                 "type": "function",
@@ -159,108 +1721,360 @@ class REPLAgent:
                         "required": ["code"],
                     },
                 },
-            }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "search_context",
+                    "description": "Search the `context` variable without running code. Returns matching lines with line numbers, character offsets and surrounding lines.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "pattern": {
+                                "type": "string",
+                                "description": "Text, regular expression, or space-separated keywords to find",
+                            },
+                            "mode": {
+                                "type": "string",
+                                "enum": list(SEARCH_MODES),
+                                "description": "literal (case-insensitive exact text, default), regex, or terms (rank passages by how many keywords they contain)",
+                            },
+                            "max_hits": {
+                                "type": "integer",
+                                "description": "Maximum number of hit windows to return (default 20)",
+                            },
+                            "window": {
+                                "type": "integer",
+                                "description": "Lines of context to show around each hit (default 1)",
+                            },
+                        },
+                        "required": ["pattern"],
+                    },
+                },
+            },
         ]
 
         # Run setup code if provided
         if setup_code:
             self.run(setup_code)
 
-    def __del__(self):
-        """Clean up temporary directory when object is destroyed."""
-        try:
-            import shutil
+    def _detach_context(self):
+        if self._shared_finalizer is not None:
+            self._shared_finalizer()
+        self._shared_context = self._shared_finalizer = None
+
+    def close(self):
+        """Remove the scratch directory and detach any shared context.
 
-            shutil.rmtree(self.temp_dir)
-        except:
-            pass
+        Also happens when the agent is garbage collected.
+        """
+        self._detach_context()
+        self.scratch.close()
 
-    def load_context(self, context_json=None, context_str=None):
-        if context_json is not None:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load_context(
+        self, context_json=None, context_str=None, shared=False, follow=None
+    ):
+        """Load context into the REPL and cache a profile of it (context_profile).
+
+        With ``shared=True`` the context is attached through ``self.registry``
+        so agents loading identical data share one copy (see ContextRegistry).
+        ``follow=path`` loads a text file and keeps tailing it: whatever was
+        written to it since is appended (see append_context) before each cell,
+        search and chat. A truncated or replaced file is loaded again.
+        """
+        if follow is not None:
+            with open(follow, "rb") as f:
+                raw, inode = f.read(), os.fstat(f.fileno()).st_ino
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")
+            self.load_context(context_str=decoder.decode(raw))
+            self._follow = {
+                "path": follow,
+                "offset": len(raw),
+                "inode": inode,
+                "decoder": decoder,
+            }
+            return
+        if context_json is None and context_str is None:
+            return
+        self._follow = None
+        self._detach_context()
+        if shared:
+            entry = self.registry.attach(context_json, context_str)
+            self._shared_context = entry
+            self._shared_finalizer = weakref.finalize(self, self.registry.detach, entry)
+            if entry.kind == "str":
+                self.state["_shared_context"] = entry.value
+                self.run("context = _shared_context")
+                del self.state["_shared_context"]
+            else:
+                self.run(
+                    f"import json\nwith open(r'{entry.path}') as f:\n"
+                    "    context = json.load(f)"
+                )
+            self.context_profile = entry.profile
+        elif context_json is not None:
+            data = json.dumps(context_json)
+            self.scratch.check_quota(len(data))
             path = os.path.join(self.temp_dir, "context.json")
             with open(path, "w") as f:
-                json.dump(context_json, f)
+                f.write(data)
             self.run(
                 f"import json\nwith open(r'{path}') as f:\n    context = json.load(f)"
             )
+            self.context_profile = profile_context(context_json, data)
         elif context_str is not None:
+            self.scratch.check_quota(len(context_str.encode()))
             path = os.path.join(self.temp_dir, "context.txt")
             with open(path, "w") as f:
                 f.write(context_str)
             self.run(f"with open(r'{path}') as f:\n    context = f.read()")
+            self.context_profile = profile_context(context_str)
+        with open(os.path.join(self.temp_dir, "context.profile.json"), "w") as f:
+            json.dump(self.context_profile, f)
+        self._feed.update(mark=0, seen=0, growing=False)
 
-    def run(self, code):
-        start = time.time()
-        old_cwd, old_stdout, old_stderr = os.getcwd(), sys.stdout, sys.stderr
-        stdout_buf, stderr_buf = io.StringIO(), io.StringIO()
-        sys.stdout, sys.stderr = stdout_buf, stderr_buf
+    def append_context(self, data):
+        """Extend the loaded context with data instead of reloading it.
 
+        A string context is extended with a string, a list context with a list
+        (or a single item) and a dict context is updated with a dict. The search
+        index, profile and memo are updated from data alone, so each append
+        costs in proportion to data, and ``new_context()`` in the REPL returns
+        what was appended since the previous cell started.
+        """
+        context = self.state.get("context")
+        if context is None:
+            if isinstance(data, str):
+                self.load_context(context_str=data)
+            else:
+                self.load_context(context_json=data)
+            self._feed["growing"] = True
+            return
+        if isinstance(context, str):
+            if not isinstance(data, str):
+                raise TypeError("a string context can only be extended with a string")
+            context = self.state["context"] = context + data
+            index = self._context_index
+            if index is not None and isinstance(index.source, str):
+                index.extend(context)
+        elif isinstance(context, list):
+            data = data if isinstance(data, list) else [data]
+            context.extend(data)
+            self._context_index = None
+        elif isinstance(context, dict) and isinstance(data, dict):
+            context.update(data)
+            self._context_index = None
+        else:
+            raise TypeError(
+                f"cannot append {type(data).__name__} to a "
+                f"{type(context).__name__} context"
+            )
+        # The context no longer matches a shared entry
+        self._detach_context()
+        if self.memo is not None:
+            self.memo.invalidate("context")
+        if self.context_profile is not None:
+            self.context_profile = extend_profile(self.context_profile, context, data)
+            with open(os.path.join(self.temp_dir, "context.profile.json"), "w") as f:
+                json.dump(self.context_profile, f)
+        self._feed["growing"] = True
+
+    def _poll_follow(self):
+        """Append what was written to the followed file since the last poll."""
+        follow = self._follow
+        if follow is None:
+            return
         try:
-            os.chdir(self.temp_dir)
-            lines = code.split("\n")
-            # Only extract top-level imports (not indented), as indented imports
-            # are part of control flow structures like try/except
-            imports = [
-                l
-                for l in lines
-                if l.strip().startswith(("import ", "from "))
-                and not l.strip().startswith("#")
-                and not l.startswith((" ", "\t"))  # Not indented
+            stat = os.stat(follow["path"])
+        except OSError:
+            return
+        if stat.st_ino != follow["inode"] or stat.st_size < follow["offset"]:
+            # Rotated or truncated: start over from the new contents
+            self.load_context(follow=follow["path"])
+            self._feed["growing"] = True
+        elif stat.st_size > follow["offset"]:
+            with open(follow["path"], "rb") as f:
+                f.seek(follow["offset"])
+                raw = f.read()
+            follow["offset"] += len(raw)
+            text = follow["decoder"].decode(raw)
+            if text:
+                self.append_context(text)
+
+    def search_context(
+        self, pattern, mode="literal", max_hits=20, window=1, timeout=None
+    ):
+        """Search `context` natively (no cell execution) and return hit windows.
+
+        ``timeout`` (seconds) bounds indexing and matching, as for cells.
+        """
+        self._poll_follow()
+        context = self.state.get("context")
+        if context is None:
+            return "Error: No context loaded"
+        max_hits, window = max(1, max_hits), max(0, window)
+        try:
+            with _time_limit(timeout, "Search"):
+                index = self._context_index
+                shared = self._shared_context
+                if (
+                    shared is not None
+                    and shared.kind == "str"
+                    and shared.value is context
+                ):
+                    index = shared.index()
+                elif index is None or index.source is not context:
+                    text = (
+                        context
+                        if isinstance(context, str)
+                        else json.dumps(context, indent=1, default=str)
+                    )
+                    index = self._context_index = _ContextIndex(text, context)
+                result = index.search(pattern, mode, max_hits, window)
+        except (re.error, ValueError, TimeoutError) as e:
+            return f"Error: {type(e).__name__}: {e}"
+        return elide(result, self.output_budget, self.model)
+
+    def _exec_cell(self, code):
+        lines = code.split("\n")
+        # Only extract top-level imports (not indented), as indented imports
+        # are part of control flow structures like try/except
+        imports = [
+            l
+            for l in lines
+            if l.strip().startswith(("import ", "from "))
+            and not l.strip().startswith("#")
+            and not l.startswith((" ", "\t"))  # Not indented
+        ]
+        others = [l for l in lines if l not in imports]
+
+        if imports:
+            exec("\n".join(imports), self.state)
+
+        if others:
+            non_empty = [
+                l for l in others if l.strip() and not l.strip().startswith("#")
             ]
-            others = [l for l in lines if l not in imports]
-
-            if imports:
-                exec("\n".join(imports), self.state)
-
-            if others:
-                non_empty = [
-                    l for l in others if l.strip() and not l.strip().startswith("#")
-                ]
-                if non_empty:
-                    last = non_empty[-1].strip()
-                    is_expr = (
-                        not last.startswith(
-                            (
-                                "import ",
-                                "from ",
-                                "def ",
-                                "class ",
-                                "if ",
-                                "for ",
-                                "while ",
-                                "try:",
-                                "with ",
-                                "return ",
-                                "yield ",
-                                "break",
-                                "continue",
-                                "pass",
-                                "raise",
-                                "print(",
-                            )
+            if non_empty:
+                last = non_empty[-1].strip()
+                is_expr = (
+                    not last.startswith(
+                        (
+                            "import ",
+                            "from ",
+                            "def ",
+                            "class ",
+                            "if ",
+                            "for ",
+                            "while ",
+                            "try:",
+                            "with ",
+                            "return ",
+                            "yield ",
+                            "break",
+                            "continue",
+                            "pass",
+                            "raise",
+                            "print(",
                         )
-                        and "=" not in last.split("#")[0]
-                        and not last.endswith(":")
                     )
+                    and "=" not in last.split("#")[0]
+                    and not last.endswith(":")
+                )
 
-                    if is_expr:
-                        try:
-                            idx = next(
-                                i
-                                for i in range(len(others) - 1, -1, -1)
-                                if others[i].strip() == last
-                            )
-                            if idx > 0:
-                                exec("\n".join(others[:idx]), self.state)
-                            result = eval(last, self.state)
-                            if result is not None:
-                                print(repr(result))
-                        except:
-                            exec("\n".join(others), self.state)
-                    else:
+                if is_expr:
+                    try:
+                        idx = next(
+                            i
+                            for i in range(len(others) - 1, -1, -1)
+                            if others[i].strip() == last
+                        )
+                        if idx > 0:
+                            exec("\n".join(others[:idx]), self.state)
+                        result = eval(last, self.state)
+                        if result is not None:
+                            print(repr(result))
+                    except:
                         exec("\n".join(others), self.state)
-                elif others:
+                else:
                     exec("\n".join(others), self.state)
+            elif others:
+                exec("\n".join(others), self.state)
+
+    def _run_magic(self, name, opts, body):
+        """Run an IPython-style %time/%timeit/%prun cell; output goes to stdout."""
+        opts = dict(re.findall(r"-([nrl])\s*(\d+)", opts))
+        body = body.strip()
+        if name == "time":
+            wall, cpu = time.perf_counter(), os.times()
+            try:
+                self._exec_cell(body)
+            finally:
+                end = os.times()
+                user, system = end.user - cpu.user, end.system - cpu.system
+                print(
+                    f"CPU times: user {_format_seconds(user)}, sys {_format_seconds(system)}, "
+                    f"total {_format_seconds(user + system)}\n"
+                    f"Wall time: {_format_seconds(time.perf_counter() - wall)}"
+                )
+        elif name == "timeit":
+            timer = timeit.Timer(body, globals=self.state)
+            real_stdout, sys.stdout = sys.stdout, io.StringIO()
+            try:
+                number = int(opts["n"]) if "n" in opts else timer.autorange()[0]
+                runs = [t / number for t in timer.repeat(int(opts.get("r", 7)), number)]
+            finally:
+                sys.stdout = real_stdout
+            std = statistics.stdev(runs) if len(runs) > 1 else 0.0
+            print(
+                f"{_format_seconds(statistics.mean(runs))} ± {_format_seconds(std)} per loop "
+                f"(mean ± std. dev. of {len(runs)} runs, {number} loops each; "
+                f"best {_format_seconds(min(runs))})"
+            )
+        else:
+            profile = cProfile.Profile()
+            try:
+                profile.runcall(self._exec_cell, body)
+            finally:
+                stats = pstats.Stats(profile, stream=sys.stdout)
+                stats.strip_dirs().sort_stats("cumulative").print_stats(
+                    int(opts.get("l", 20))
+                )
+
+    def run(self, code, max_tokens=None, timeout=None):
+        start = time.time()
+        self._poll_follow()
+        feed = self._feed
+        feed["mark"] = feed["seen"]
+        if "context" not in self.state.spilled:
+            # A spilled context has not grown, so is not loaded back to measure
+            context = self.state.get("context")
+            feed["seen"] = len(context) if isinstance(context, (str, list, dict)) else 0
+        _EXEC_LOCK.acquire()
+        old_cwd, old_stdout, old_stderr = os.getcwd(), sys.stdout, sys.stderr
+        stdout_buf, stderr_buf = io.StringIO(), io.StringIO()
+        sys.stdout, sys.stderr = stdout_buf, stderr_buf
+        cell = None
+
+        try:
+            os.chdir(self.temp_dir)
+            if self.memo is not None:
+                cell = self.memo.prepare(code)
+            magic = _MAGIC_RE.match(code)
+            with _time_limit(timeout):
+                if cell is not None and cell.entry is not None:
+                    self.memo.restore(cell.entry)
+                elif magic:
+                    self._run_magic(magic.group(1), magic.group(2), code[magic.end() :])
+                else:
+                    self._exec_cell(code)
+            self.scratch.check_quota()
 
             output, error = stdout_buf.getvalue(), stderr_buf.getvalue()
         except Exception as e:
@@ -269,89 +2083,242 @@ class REPLAgent:
         finally:
             sys.stdout, sys.stderr = old_stdout, old_stderr
             os.chdir(old_cwd)
+            _EXEC_LOCK.release()
+
+        if cell is not None:
+            self.memo.finish(cell, output, error)
 
         # Save stdout and stderr to state for access
         self.state["_stdout"] = output
         self.state["_stderr"] = error
 
-        vars_list = [
-            k for k in self.state if not k.startswith("_") and k != "__builtins__"
-        ]
+        output = elide(
+            output,
+            max_tokens if max_tokens is not None else self.output_budget,
+            self.model,
+        )
+        vars_list = self.state.user_names()
         if vars_list and not error:
             output += f"\n[Variables: {', '.join(vars_list)}]"
+        if self.memory_limit is not None:
+            try:
+                self.state.account(code)
+                self.state.spill(self.memory_limit)
+            except Exception as e:
+                # Accounting is advisory; a value it cannot measure or pickle
+                # must not turn a successful cell into a failed run()
+                output += f"\n[Memory accounting failed: {type(e).__name__}: {e}]"
+            else:
+                used = sum(self.state.sizes.values())
+                output += f"\n[Memory: {used / 2**20:.1f} MB of {self.memory_limit / 2**20:.1f} MB"
+                if self.state.spilled:
+                    output += f"; spilled to disk: {', '.join(self.state.spilled)}"
+                output += "]"
+        if feed["growing"] and feed["seen"] > feed["mark"]:
+            unit = "chars" if isinstance(self.state.get("context"), str) else "items"
+            output += (
+                f"\n[Context: {feed['seen'] - feed['mark']:,} new {unit} since the "
+                "previous cell; new_context() returns them]"
+            )
+        if cell is not None and cell.entry is not None:
+            output += "\n[Memoized: restored output and variables of an identical earlier run]"
         if not error:
             output += f"\n[Execution: {time.time() - start:.3f}s]"
-        if len(output) > 2000:
-            output = output[:2000] + f"\n... (truncated {len(output) - 2000} chars)"
 
         return (
             f"{output}Error: {error}"
             if error and output
-            else f"Error: {error}"
-            if error
-            else output
+            else f"Error: {error}" if error else output
         )
 
-    def chat(self, user_message, max_iterations=10, verbose=False):
-        messages = [
-            {"role": "system", "content": REPL_SYSTEM_PROMPT},
-            {"role": "user", "content": user_message},
-        ]
-        for i in range(max_iterations):
-            if verbose:
-                print(f"\n[Iteration {i + 1}]")
+    def chat(
+        self,
+        user_message,
+        max_iterations=10,
+        verbose=False,
+        deadline=None,
+        max_tokens_total=None,
+        max_cost=None,
+        include_profile=True,
+    ):
+        """Answer user_message, running the model's code until it replies.
+
+        ``deadline`` (seconds), ``max_tokens_total`` and ``max_cost`` (USD, see
+        MODEL_PRICES) bound the whole call. The time left caps each completion
+        request and each cell, the budget left is shown to the model in tool
+        results, and once a limit is reached the model is asked for its best
+        answer without tools (or, when time is up, the best text so far is
+        returned without another request). Off the main thread a cell stuck
+        in a blocking C call is only interrupted once that call returns. With ``include_profile``, the
+        profile of the loaded context is placed before the first user message
+        so the model can skip exploratory cells.
+        """
+        self._poll_follow()
+        budget = _Budget(self.model, deadline, max_tokens_total, max_cost)
+        store = self.transcript
+        if store:
+            self.session_id = store.start_session(self.model)
+        messages = []
+
+        def add(message):
+            messages.append(message)
+            if store:
+                store.add_message(self.session_id, message)
+
+        def complete(**kwargs):
+            start = time.time()
+            if budget.end is not None:
+                kwargs["timeout"] = budget.time_left()
             response = self.client.chat.completions.create(
-                model=self.model, messages=messages, tools=self.tools
+                model=self.model, messages=messages, **kwargs
             )
-            msg = response.choices[0].message
-            if msg.tool_calls:
-                if verbose:
-                    print(f"Tool calls: {len(msg.tool_calls)}")
-                messages.append(
-                    {
-                        "role": "assistant",
-                        "content": msg.content,
-                        "tool_calls": [
-                            {
-                                "id": tc.id,
-                                "type": "function",
-                                "function": {
-                                    "name": tc.function.name,
-                                    "arguments": tc.function.arguments,
-                                },
-                            }
-                            for tc in msg.tool_calls
-                        ],
-                    }
+            usage = getattr(response, "usage", None)
+            for key in self.last_usage:
+                self.last_usage[key] += getattr(usage, key, None) or 0
+            if store:
+                store.add_completion(self.session_id, time.time() - start, usage)
+            return response
+
+        def finish(content):
+            if store:
+                store.add_message(
+                    self.session_id, {"role": "assistant", "content": content}
                 )
-                for tc in msg.tool_calls:
-                    args = json.loads(tc.function.arguments)
+            return content
+
+        add({"role": "system", "content": REPL_SYSTEM_PROMPT})
+        if include_profile and self.context_profile is not None:
+            user_message = CONTEXT_PROFILE_PROMPT.format(
+                profile=format_profile(self.context_profile), query=user_message
+            )
+        add({"role": "user", "content": user_message})
+        self._final.clear()
+        self.final_answer = self.final_summary = None
+        self.last_usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        iterations = 0
+        try:
+            for i in range(max_iterations):
+                iterations = i + 1
+                if verbose:
+                    print(f"\n[Iteration {i + 1}]")
+                try:
+                    response = complete(tools=self.tools)
+                except Exception:
+                    if budget.exhausted(self.last_usage) != "time":
+                        raise
+                    return finish(_best_answer(messages))
+                msg = response.choices[0].message
+                if msg.tool_calls:
                     if verbose:
-                        print(
-                            f"  Calling {tc.function.name}\n  Code:\n{args.get('code', '')}\n"
-                        )
-                    result = (
-                        self.run(args["code"])
-                        if tc.function.name == "python_exec"
-                        else f"Error: Unknown function {tc.function.name}"
+                        print(f"Tool calls: {len(msg.tool_calls)}")
+                    self.output_budget = self._scaled_output_budget(
+                        messages, response, len(msg.tool_calls)
                     )
-                    if verbose:
-                        print(f"  Result:\n{result}\n")
-                    messages.append(
+                    add(
                         {
-                            "role": "tool",
-                            "tool_call_id": tc.id,
-                            "name": tc.function.name,
-                            "content": result or "(No output)",
+                            "role": "assistant",
+                            "content": msg.content,
+                            "tool_calls": [
+                                {
+                                    "id": tc.id,
+                                    "type": "function",
+                                    "function": {
+                                        "name": tc.function.name,
+                                        "arguments": tc.function.arguments,
+                                    },
+                                }
+                                for tc in msg.tool_calls
+                            ],
                         }
                     )
-            else:
-                if verbose:
-                    print("Final response received")
-                self.last_messages = messages
-                return msg.content
-        self.last_messages = messages
-        return "Max iterations reached. The model may need more steps to complete the task."
+                    for tc in msg.tool_calls:
+                        args = json.loads(tc.function.arguments)
+                        if verbose:
+                            print(
+                                f"  Calling {tc.function.name}\n  Code:\n{args.get('code', '')}\n"
+                            )
+                        start = time.time()
+                        if tc.function.name == "python_exec":
+                            result = self.run(args["code"], timeout=budget.time_left())
+                        elif tc.function.name == "search_context":
+                            try:
+                                kwargs = _search_args(args)
+                            except ValueError as e:
+                                result = f"Error: Invalid search_context arguments: {e}"
+                            else:
+                                result = self.search_context(
+                                    **kwargs, timeout=budget.time_left()
+                                )
+                        else:
+                            result = f"Error: Unknown function {tc.function.name}"
+                        if store:
+                            store.add_tool_call(
+                                self.session_id,
+                                tc.id,
+                                tc.function.name,
+                                args,
+                                result,
+                                time.time() - start,
+                            )
+                        if verbose:
+                            print(f"  Result:\n{result}\n")
+                        add(
+                            {
+                                "role": "tool",
+                                "tool_call_id": tc.id,
+                                "name": tc.function.name,
+                                "content": (result or "(No output)")
+                                + budget.status(self.last_usage),
+                            }
+                        )
+                        if "value" in self._final:
+                            break
+                    if "value" in self._final:
+                        # Return the live object instead of having the model
+                        # re-generate it token by token in a final message.
+                        self.final_answer = self._final.pop("value")
+                        self.final_summary = _summarize(self.final_answer)
+                        if verbose:
+                            print(f"Final answer set: {self.final_summary}")
+                        finish(self.final_summary)
+                        return self.final_answer
+                    limit = budget.exhausted(self.last_usage)
+                    if limit == "time":
+                        return finish(_best_answer(messages))
+                    if limit:
+                        if verbose:
+                            print(f"Budget exhausted ({limit}), forcing an answer")
+                        add(
+                            {
+                                "role": "user",
+                                "content": BUDGET_EXHAUSTED_PROMPT.format(limit=limit),
+                            }
+                        )
+                        response = complete(tools=self.tools, tool_choice="none")
+                        return finish(response.choices[0].message.content)
+                else:
+                    if verbose:
+                        print("Final response received")
+                    return finish(msg.content)
+            return "Max iterations reached. The model may need more steps to complete the task."
+        finally:
+            self.last_messages = messages
+            self.output_budget = self.max_output_tokens
+            if store:
+                store.end_session(self.session_id, iterations)
+
+    def _scaled_output_budget(self, messages, response, n_calls):
+        """Per-result token budget, shrinking as the context window fills up."""
+        usage = getattr(response, "usage", None)
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            used = usage.prompt_tokens + (usage.completion_tokens or 0)
+        else:
+            used = sum(
+                count_tokens(m.get("content") or "", self.model) for m in messages
+            )
+        # Leave three quarters of what is left for later iterations
+        remaining = max(0, self.context_window - used)
+        return min(self.max_output_tokens, max(64, remaining // (4 * n_calls)))
 
     def get_tool_calls(self):
         calls = []
@@ -380,3 +2347,530 @@ class REPLAgent:
             else:
                 print(f"Arguments: {tc['arguments']}")
         print("=" * 80)
+
+
+SCRATCH_PREFIX = "repl_agent_pid"
+_swept_roots = set()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+
+def sweep_orphans(root=None):
+    """Remove scratch dirs under root whose owning process no longer exists."""
+    root = root or tempfile.gettempdir()
+    removed = []
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return removed
+    for entry in entries:
+        pid = entry.name[len(SCRATCH_PREFIX) :].split("_", 1)[0]
+        if (
+            entry.name.startswith(SCRATCH_PREFIX)
+            and pid.isdigit()
+            and entry.is_dir(follow_symlinks=False)
+            and not _pid_alive(int(pid))
+        ):
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(entry.path)
+    return removed
+
+
+def _disk_usage(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class ScratchDir:
+    """Per-session scratch directory with deterministic cleanup and a disk quota.
+
+    The directory is removed by close(), on leaving a ``with`` block, when the
+    object is garbage collected, or at interpreter exit, whichever comes first.
+    ``in_memory=True`` places it on tmpfs (/dev/shm) where available. The first
+    ScratchDir created under a root also removes dirs left by dead processes.
+    """
+
+    def __init__(self, quota=None, in_memory=False, root=None):
+        if root is None and in_memory and os.path.isdir("/dev/shm"):
+            root = "/dev/shm"
+        root = root or tempfile.gettempdir()
+        if root not in _swept_roots:
+            _swept_roots.add(root)
+            sweep_orphans(root)
+        self.quota = quota
+        self.path = tempfile.mkdtemp(prefix=f"{SCRATCH_PREFIX}{os.getpid()}_", dir=root)
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, self.path, ignore_errors=True
+        )
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def usage(self):
+        return _disk_usage(self.path)
+
+    def check_quota(self, extra=0):
+        """Raise OSError(EDQUOT) if usage plus extra bytes would exceed the quota."""
+        if self.quota is None:
+            return
+        used = self.usage() + extra
+        if used > self.quota:
+            raise OSError(
+                errno.EDQUOT,
+                f"Scratch quota exceeded: {used} bytes used, limit {self.quota}",
+            )
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+MAP_PROMPT = """You are worker {part} of {parts}. Your `context` is one part of a much larger document; the other parts are being read by other workers at the same time. Answer the query below using only your part.
+
+When you are done, call `final({{"answer": ..., "evidence": [...], "relevant": ...}})` where "answer" is your partial answer (None if your part has nothing relevant), "evidence" is a short list of supporting quotes, and "relevant" is True or False.
+
+Query: {query}"""
+
+REDUCE_PROMPT = """Your `context` is a list of partial answers, one per part of a large document, in document order. Each has "part", "answer", "evidence" and "relevant" keys and was written by a worker that only saw its own part. Combine them into a single final answer to the query, resolving conflicts and ignoring irrelevant parts.
+
+Query: {query}"""
+
+
+def _default_chunker(context, k):
+    if isinstance(context, str):
+        return [context[start:end] for start, end in _line_chunks(context, k)]
+    if isinstance(context, list):
+        size = max(1, -(-len(context) // k))
+        return [context[i : i + size] for i in range(0, len(context), size)]
+    raise TypeError("map_reduce_chat needs a str or list context, or a chunker")
+
+
+def map_reduce_chat(
+    query,
+    context,
+    chunker=None,
+    k=8,
+    max_workers=None,
+    model="gpt-4o-mini",
+    max_iterations=10,
+    make_agent=None,
+):
+    """Answer query over a huge context with k parallel map sessions and a reduce.
+
+    ``chunker(context, k)`` returns the parts (line-aligned for strings by
+    default). Each part gets its own REPLAgent, at most ``max_workers`` (default
+    k) run at once, and each returns a structured partial answer via final().
+    A reduce session then combines the partials. Returns a dict with the
+    "answer", the "partials" and per-stage timing and token "stats".
+    """
+    make_agent = make_agent or (lambda: REPLAgent(model=model))
+    chunks = (chunker or _default_chunker)(context, k)
+
+    def run_agent(prompt, **context_kwargs):
+        start = time.time()
+        with make_agent() as agent:
+            agent.load_context(**context_kwargs)
+            answer = agent.chat(prompt, max_iterations=max_iterations)
+            return answer, dict(agent.last_usage), time.time() - start
+
+    def map_part(part, chunk):
+        kwargs = (
+            {"context_str": chunk}
+            if isinstance(chunk, str)
+            else {"context_json": chunk}
+        )
+        prompt = MAP_PROMPT.format(part=part + 1, parts=len(chunks), query=query)
+        answer, usage, seconds = run_agent(prompt, **kwargs)
+        if not isinstance(answer, dict):
+            answer = {"answer": answer, "evidence": [], "relevant": True}
+        return {"part": part + 1, **answer}, usage, seconds
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers or len(chunks) or 1) as pool:
+        mapped = list(pool.map(map_part, range(len(chunks)), chunks))
+    map_seconds = time.time() - start
+    partials = [partial for partial, _, _ in mapped]
+    answer, reduce_usage, reduce_seconds = run_agent(
+        REDUCE_PROMPT.format(query=query), context_json=partials
+    )
+    map_usage = {key: sum(usage[key] for _, usage, _ in mapped) for key in reduce_usage}
+    return {
+        "answer": answer,
+        "partials": partials,
+        "stats": {
+            "chunks": len(chunks),
+            "map_seconds": map_seconds,
+            "map_part_seconds": [seconds for _, _, seconds in mapped],
+            "reduce_seconds": reduce_seconds,
+            "total_seconds": map_seconds + reduce_seconds,
+            "map_tokens": map_usage,
+            "reduce_tokens": reduce_usage,
+        },
+    }
+
+
+class _SharedContext:
+    """One distinct context held by a ContextRegistry."""
+
+    def __init__(self, digest, kind, value, path, profile):
+        self.digest = digest
+        self.kind = kind  # "str" or "json"
+        self.value = value  # The shared str, or the JSON text
+        self.path = path
+        self.profile = profile
+        self.refs = 0
+        self._index = None
+        self._lock = threading.Lock()
+
+    def index(self):
+        """Line index over a shared string, built once for all attached agents."""
+        with self._lock:
+            if self._index is None:
+                self._index = _ContextIndex(self.value)
+            return self._index
+
+
+class ContextRegistry:
+    """Content-addressed, reference-counted store of read-only contexts.
+
+    Agents that load identical data attach to one entry: string contexts
+    share a single str object, its line index and its profile, and every
+    context is written once to a file in the registry's scratch dir (on tmpfs
+    when available) instead of once per agent. JSON contexts share the file
+    and profile; each agent still parses its own mutable copy. An entry is
+    evicted when the last agent detaches.
+    """
+
+    def __init__(self, in_memory=True):
+        self.in_memory = in_memory
+        self.entries = {}
+        self.lock = threading.Lock()
+        self._scratch = None
+
+    def attach(self, context_json=None, context_str=None):
+        if context_str is not None:
+            kind, text = "str", context_str
+        else:
+            kind, text = "json", json.dumps(context_json)
+        digest = hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                if self._scratch is None or self._scratch.closed:
+                    self._scratch = ScratchDir(in_memory=self.in_memory)
+                path = os.path.join(self._scratch.path, f"{digest}.{kind}")
+                with open(path, "w") as f:
+                    f.write(text)
+                profile = profile_context(
+                    text if kind == "str" else context_json,
+                    None if kind == "str" else text,
+                )
+                entry = self.entries[digest] = _SharedContext(
+                    digest, kind, text, path, profile
+                )
+            entry.refs += 1
+            return entry
+
+    def detach(self, entry):
+        with self.lock:
+            entry.refs -= 1
+            if entry.refs <= 0 and self.entries.get(entry.digest) is entry:
+                del self.entries[entry.digest]
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                digest: {"kind": e.kind, "refs": e.refs, "chars": len(e.value)}
+                for digest, e in self.entries.items()
+            }
+
+
+CONTEXT_REGISTRY = ContextRegistry()
+
+
+class _Session:
+    def __init__(self, agent):
+        self.agent = agent
+        self.lock = threading.Lock()
+        self.created = self.last_used = time.time()
+        self.closed = False
+        self.memory = None  # Resident bytes when last measured
+
+    def close(self):
+        """Close the agent; the caller holds self.lock."""
+        self.closed = True
+        self.agent.close()
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                reply = {"ok": True, "result": self.server.owner.handle(request)}
+            except Exception as e:
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(reply, default=repr).encode() + b"\n")
+            self.wfile.flush()
+
+
+class REPLServer:
+    """Long-lived process hosting named REPLAgent sessions over a local socket.
+
+    ``address`` is a filesystem path (Unix socket) or a ``(host, port)`` tuple.
+    Requests are newline-delimited JSON objects ``{"op", "session", "args"}``.
+    Each connection is served on its own thread; requests to the same session
+    are serialized, and sessions idle for ``idle_timeout`` seconds are evicted.
+
+    Sessions run arbitrary code, so TCP servers bind only loopback hosts
+    unless a ``token`` is given, which every request must then carry.
+    """
+
+    OPS = (
+        "run",
+        "load_context",
+        "append_context",
+        "chat",
+        "snapshot",
+        "close",
+        "sessions",
+    )
+
+    def __init__(self, address, idle_timeout=3600, token=None, **agent_kwargs):
+        if not isinstance(address, str) and not _is_loopback(address[0]):
+            if not token:
+                raise ValueError(
+                    f"Refusing to serve on non-loopback host {address[0]!r} "
+                    "without a token"
+                )
+        self.address = address
+        self.idle_timeout = idle_timeout
+        self.token = token
+        self.agent_kwargs = agent_kwargs
+        self.sessions = {}
+        self.lock = threading.Lock()
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = socketserver.ThreadingUnixStreamServer(
+                address, _RequestHandler
+            )
+        else:
+            self.server = socketserver.ThreadingTCPServer(address, _RequestHandler)
+        self.server.daemon_threads = True
+        self.server.owner = self
+        self._stop = threading.Event()
+
+    def serve_forever(self):
+        threading.Thread(target=self._evict_loop, daemon=True).start()
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve on a background thread and return self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self._stop.set()
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        with self.lock:
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            with session.lock:
+                session.close()
+
+    def _evict_loop(self):
+        while not self._stop.wait(min(60, self.idle_timeout / 4)):
+            self.evict_idle()
+
+    def evict_idle(self):
+        cutoff = time.time() - self.idle_timeout
+        with self.lock:
+            for name, session in list(self.sessions.items()):
+                # Holding the session lock keeps a request that has already
+                # looked the session up from running on a closed agent
+                if session.last_used < cutoff and session.lock.acquire(False):
+                    try:
+                        del self.sessions[name]
+                        session.close()
+                    finally:
+                        session.lock.release()
+
+    def _session(self, name, model=None):
+        with self.lock:
+            session = self.sessions.get(name)
+            if session is None:
+                kwargs = dict(self.agent_kwargs)
+                if model:
+                    kwargs["model"] = model
+                session = self.sessions[name] = _Session(REPLAgent(**kwargs))
+            return session
+
+    def handle(self, request):
+        if self.token is not None and not hmac.compare_digest(
+            str(request.get("token", "")), self.token
+        ):
+            raise PermissionError("Invalid or missing token")
+        op, name = request["op"], request.get("session", "default")
+        args = request.get("args", {})
+        if op not in self.OPS:
+            raise ValueError(f"Unknown op {op!r}")
+        if op == "sessions":
+            with self.lock:
+                sessions = dict(self.sessions)
+            report = {}
+            for n, s in sessions.items():
+                # Measure idle sessions only; busy ones report their last size
+                if s.lock.acquire(False):
+                    try:
+                        if not s.closed:
+                            s.memory = _resident_bytes(s.agent.state.memory_usage())
+                    finally:
+                        s.lock.release()
+                report[n] = {
+                    "idle": time.time() - s.last_used,
+                    "busy": s.lock.locked(),
+                    "memory": s.memory,
+                }
+            return report
+        if op == "close":
+            with self.lock:
+                session = self.sessions.pop(name, None)
+            if session is None:
+                return False
+            with session.lock:
+                session.close()
+            return True
+        while True:
+            session = self._session(name, request.get("model"))
+            with session.lock:
+                if session.closed:
+                    continue  # Evicted after the lookup; start a fresh session
+                session.last_used = time.time()
+                try:
+                    if op == "snapshot":
+                        variables = session.agent.state.memory_usage()
+                        session.memory = _resident_bytes(variables)
+                        return {
+                            "model": session.agent.model,
+                            "created": session.created,
+                            "memory": session.memory,
+                            "variables": variables,
+                        }
+                    return getattr(session.agent, op)(**args)
+                finally:
+                    session.last_used = time.time()
+
+
+class REPLClient:
+    """Thin client for one REPLServer session, mirroring REPLAgent's methods."""
+
+    def __init__(self, address, session="default", model=None, token=None):
+        self.address = address
+        self.session = session
+        self.model = model
+        self.token = token
+
+    def _call(self, op, **args):
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        request = {"op": op, "session": self.session, "args": args}
+        if self.model:
+            request["model"] = self.model
+        if self.token:
+            request["token"] = self.token
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.connect(self.address)
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                reply = json.loads(f.readline())
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        return reply["result"]
+
+    def run(self, code, max_tokens=None, timeout=None):
+        return self._call("run", code=code, max_tokens=max_tokens, timeout=timeout)
+
+    def load_context(
+        self, context_json=None, context_str=None, shared=False, follow=None
+    ):
+        return self._call(
+            "load_context",
+            context_json=context_json,
+            context_str=context_str,
+            shared=shared,
+            follow=follow,
+        )
+
+    def append_context(self, data):
+        return self._call("append_context", data=data)
+
+    def chat(self, user_message, max_iterations=10, **budget):
+        return self._call(
+            "chat", user_message=user_message, max_iterations=max_iterations, **budget
+        )
+
+    def snapshot(self):
+        return self._call("snapshot")
+
+    def close(self):
+        return self._call("close")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve REPLAgent sessions locally.")
+    parser.add_argument("socket", help="Unix socket path, or HOST:PORT for TCP")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--idle-timeout", type=float, default=3600)
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("REPL_SERVER_TOKEN"),
+        help="Shared secret clients must send (required for non-loopback TCP hosts)",
+    )
+    opts = parser.parse_args()
+    host, _, port = opts.socket.rpartition(":")
+    address = (host, int(port)) if port.isdigit() and host else opts.socket
+    server = REPLServer(
+        address, idle_timeout=opts.idle_timeout, token=opts.token, model=opts.model
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
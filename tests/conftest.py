@@ -0,0 +1,48 @@
+"""Shared fixtures for tests that drive chat() without a network."""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+
+class FakeClient:
+    """Stand-in for the OpenAI client that replays scripted responses.
+
+    Each script item is either a string (a final answer) or a list of
+    ``(function_name, arguments_dict)`` tool calls.
+    """
+
+    def __init__(self, script, usage=(10, 5)):
+        self.script = list(script)
+        self.requests = []
+        self.usage = usage
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        item = self.script.pop(0)
+        if isinstance(item, str):
+            message = SimpleNamespace(content=item, tool_calls=None)
+        else:
+            message = SimpleNamespace(
+                content=None,
+                tool_calls=[
+                    SimpleNamespace(
+                        id=f"call_{len(self.requests)}_{i}",
+                        function=SimpleNamespace(name=name, arguments=json.dumps(args)),
+                    )
+                    for i, (name, args) in enumerate(item)
+                ],
+            )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=message)],
+            usage=SimpleNamespace(
+                prompt_tokens=self.usage[0], completion_tokens=self.usage[1]
+            ),
+        )
+
+
+@pytest.fixture
+def fake_client():
+    """Factory that builds a FakeClient from a script of responses."""
+    return FakeClient
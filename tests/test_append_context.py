@@ -0,0 +1,106 @@
+"""Tests for growing contexts: append_context and load_context(follow=...)."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent, profile_context
+import pytest
+
+
+@pytest.fixture
+def agent():
+    """Create an agent with a small text context."""
+    agent = REPLAgent()
+    agent.load_context(context_str="alpha one\nbeta two\n")
+    yield agent
+    del agent
+
+
+class TestAppendContext:
+    """Test extending a loaded context in place."""
+
+    def test_str_append_and_new_context(self, agent):
+        """Test appended text is visible and new_context() returns only it."""
+        agent.run("print(len(context))")
+        agent.append_context("gamma three\n")
+        result = agent.run("print(repr(new_context()))")
+        assert "'gamma three\\n'" in result
+        assert "[Context: 12 new chars since the previous cell" in result
+        result = agent.run("print(repr(new_context()))")
+        assert "''" in result and "[Context:" not in result
+        assert agent.state["context"].endswith("beta two\ngamma three\n")
+
+    def test_profile_matches_full_rescan(self, agent):
+        """Test the incrementally updated profile equals a fresh profile."""
+        for piece in ["gamma thr", "ee\ndelta", " four\n", "é\n" * 3000]:
+            agent.append_context(piece)
+            fresh = profile_context(agent.state["context"])
+            for key in ("chars", "lines", "words", "bytes", "encoding", "head", "tail"):
+                assert agent.context_profile[key] == fresh[key], key
+
+    def test_search_index_extended(self, agent):
+        """Test search_context sees appended lines without a rebuild."""
+        agent.search_context("beta")
+        index = agent._context_index
+        agent.append_context("needle four\n")
+        assert "> 3| needle four" in agent.search_context("needle")
+        assert agent._context_index is index
+
+    def test_list_context(self):
+        """Test list contexts are extended in place and counted in items."""
+        agent = REPLAgent()
+        agent.load_context(context_json=[{"id": 1}])
+        agent.run("first = context")
+        agent.append_context([{"id": 2}, {"id": 3}])
+        agent.append_context({"id": 4})
+        result = agent.run("print(first is context, [r['id'] for r in new_context()])")
+        assert "True [2, 3, 4]" in result
+        assert "[Context: 3 new items" in result
+        assert agent.context_profile["items"] == 4
+        assert profile_context(agent.state["context"])["bytes"] == agent.context_profile["bytes"]
+
+    def test_type_mismatch(self, agent):
+        """Test appending the wrong type to a string context fails clearly."""
+        with pytest.raises(TypeError):
+            agent.append_context([1, 2])
+
+    def test_memo_invalidated(self):
+        """Test memoized cells reading context rerun after an append."""
+        agent = REPLAgent(memoize=True)
+        agent.load_context(context_str="a\n")
+        agent.run("print(len(context))")
+        agent.append_context("b\n")
+        assert "4" in agent.run("print(len(context))")
+        assert agent.memo.hits == 0
+
+
+class TestFollow:
+    """Test tailing a growing file."""
+
+    def test_follow_appends_before_each_cell(self, tmp_path):
+        """Test lines written to a followed file show up as new context."""
+        log = tmp_path / "app.log"
+        log.write_text("start\n")
+        agent = REPLAgent()
+        agent.load_context(follow=str(log))
+        assert agent.run("print(repr(context))").startswith("'start\\n'")
+        with open(log, "a") as f:
+            f.write("ERROR disk full\n")
+        result = agent.run("print(repr(new_context()))")
+        assert "'ERROR disk full\\n'" in result
+        assert "> 2| ERROR disk full" in agent.search_context("disk")
+        assert agent.context_profile["lines"] == 2
+
+    def test_follow_split_utf8_and_truncation(self, tmp_path):
+        """Test a multi-byte character split across writes and a truncated file."""
+        log = tmp_path / "app.log"
+        log.write_bytes("caf".encode() + "é".encode()[:1])
+        agent = REPLAgent()
+        agent.load_context(follow=str(log))
+        with open(log, "ab") as f:
+            f.write("é".encode()[1:] + b"\n")
+        agent.run("pass")
+        assert agent.state["context"] == "café\n"
+        log.write_text("new\n")
+        agent.run("pass")
+        assert agent.state["context"] == "new\n"
@@ -0,0 +1,99 @@
+"""Tests for per-chat deadlines, token and cost budgets, and cell timeouts."""
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repl_agent
+from repl_agent import REPLAgent, estimate_cost
+import pytest
+
+
+@pytest.fixture
+def agent():
+    """Create a fresh REPLAgent instance for each test."""
+    agent = REPLAgent()
+    yield agent
+    del agent
+
+
+class TestCellTimeout:
+    """Test run() time limits."""
+
+    def test_cell_timeout(self, agent):
+        """Test a runaway cell is interrupted and the agent stays usable."""
+        start = time.time()
+        result = agent.run("while True:\n    pass", timeout=0.2)
+        assert "TimeoutError" in result
+        assert time.time() - start < 2
+        assert "2" in agent.run("1 + 1")
+
+    def test_timeout_on_last_line_expression(self, agent):
+        """Test a timeout in an auto-printed expression is not re-executed unbounded."""
+        agent.run("def spin():\n    while True:\n        pass")
+        start = time.time()
+        assert "TimeoutError" in agent.run("spin()", timeout=0.2)
+        assert time.time() - start < 2
+
+    def test_timeout_off_main_thread(self, agent):
+        """Test cells run from worker threads (server, map-reduce) are bounded too."""
+        results = []
+        worker = threading.Thread(
+            target=lambda: results.append(agent.run("while True:\n    pass", timeout=0.2))
+        )
+        start = time.time()
+        worker.start()
+        worker.join(5)
+        assert time.time() - start < 2
+        assert "TimeoutError: Cell exceeded its 0.2s time limit" in results[0]
+        assert "2" in agent.run("1 + 1")
+
+    def test_warns_when_unenforceable(self, agent, monkeypatch):
+        """Test a timeout that cannot be applied warns instead of vanishing."""
+        monkeypatch.setattr(repl_agent, "_set_async_exc", None)
+        monkeypatch.delattr(repl_agent.signal, "setitimer")
+        with pytest.warns(RuntimeWarning, match="cannot be enforced"):
+            assert "1" in agent.run("1", timeout=1)
+
+class TestChatBudgets:
+    """Test deadline, token and cost limits on chat()."""
+
+    def test_deadline_bounds_chat(self, agent, fake_client):
+        """Test the deadline caps requests and cells and returns the best answer."""
+        agent.client = fake_client(
+            [[("python_exec", {"code": "import time\ntime.sleep(10)"})], "never"]
+        )
+        start = time.time()
+        answer = agent.chat("go", deadline=0.5)
+        assert time.time() - start < 3
+        assert agent.client.requests[0]["timeout"] <= 0.5
+        assert len(agent.client.requests) == 1
+        assert "TimeoutError" in agent.last_messages[-1]["content"]
+        assert "Budget exhausted" in answer
+
+    def test_token_budget_forces_answer(self, agent, fake_client):
+        """Test running out of tokens asks for a final answer without tools."""
+        step = [("python_exec", {"code": "x = 1"})]
+        agent.client = fake_client([step, step, "best effort"], usage=(10, 5))
+        assert agent.chat("go", max_tokens_total=20) == "best effort"
+        requests = agent.client.requests
+        assert len(requests) == 3 and requests[2]["tool_choice"] == "none"
+        assert "[Budget left: 5 tokens]" in agent.last_messages[3]["content"]
+        assert "budget is used up" in agent.last_messages[-1]["content"]
+
+    def test_cost_budget(self, agent, fake_client):
+        """Test cost is tracked from model prices and reported to the model."""
+        usage = {"prompt_tokens": 1_000_000, "completion_tokens": 0}
+        assert estimate_cost("gpt-4o-mini", usage) == 0.15
+        agent.client = fake_client(
+            [[("python_exec", {"code": "1"})], "done"], usage=(1_000_000, 0)
+        )
+        assert agent.chat("go", max_cost=1.0) == "done"
+        assert "[Budget left: $0.8500]" in agent.last_messages[-1]["content"]
+
+    def test_unpriced_model_rejects_cost_budget(self):
+        """Test a cost budget needs a known price."""
+        agent = REPLAgent(model="my-finetune")
+        with pytest.raises(ValueError, match="No price"):
+            agent.chat("go", max_cost=1.0)
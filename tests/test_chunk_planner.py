@@ -0,0 +1,86 @@
+"""Tests for the plan_chunks REPL helper."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent, count_tokens
+import pytest
+
+
+@pytest.fixture
+def agent():
+    """Create an agent with a context of numbered paragraphs."""
+    agent = REPLAgent()
+    paragraphs = [f"Paragraph {i}. " + "word " * (i % 7 + 5) for i in range(200)]
+    agent.load_context(context_str="\n\n".join(paragraphs) + "\n")
+    yield agent
+    del agent
+
+
+class TestPlanChunks:
+    """Test token-counted chunk planning over context."""
+
+    def test_chunks_cover_context_within_budget(self, agent):
+        """Test chunks tile context on paragraph breaks and fit max_tokens."""
+        chunks = agent.state["plan_chunks"](100)
+        context = agent.state["context"]
+        assert chunks[0].start == 0 and chunks[-1].end == len(context)
+        for prev, chunk in zip(chunks, chunks[1:]):
+            assert prev.end == chunk.start
+            assert context[chunk.start :].startswith("Paragraph")
+        assert all(c.tokens <= 100 for c in chunks)
+        assert chunks[0].tokens == count_tokens(chunks[0].text)
+        # Packing leaves less than one paragraph unused per chunk
+        assert all(c.tokens > 80 for c in chunks[:-1])
+
+    def test_overlap(self, agent):
+        """Test consecutive chunks share up to overlap tokens of whole units."""
+        chunks = agent.state["plan_chunks"](100, overlap=30, boundary="line")
+        for prev, chunk in zip(chunks, chunks[1:]):
+            assert prev.start < chunk.start < prev.end
+            assert count_tokens(agent.state["context"][chunk.start : prev.end]) <= 30
+
+    def test_plan_is_cached_per_context_version(self, agent):
+        """Test the same plan is reused until context grows."""
+        plan = agent.state["plan_chunks"]
+        first = plan(100)
+        assert [c is d for c, d in zip(first, plan(100))] == [True] * len(first)
+        agent.append_context("\n\nParagraph late. tail words\n")
+        grown = plan(100)
+        assert grown[0] is not first[0]
+        assert grown[-1].end == len(agent.state["context"])
+
+    def test_oversized_unit_is_split(self):
+        """Test a single paragraph larger than max_tokens is cut on whitespace."""
+        agent = REPLAgent()
+        agent.load_context(context_str="lorem ipsum " * 400)
+        chunks = agent.state["plan_chunks"](50)
+        assert len(chunks) > 10
+        assert all(c.tokens <= 60 for c in chunks)
+        assert "".join(c.text for c in chunks) == agent.state["context"]
+
+    def test_list_records(self):
+        """Test list contexts are chunked by item with lazy slices."""
+        agent = REPLAgent()
+        agent.load_context(context_json=[{"id": i, "body": "x " * 20} for i in range(50)])
+        result = agent.run(
+            "chunks = plan_chunks(120, boundary='record')\n"
+            "print(len(chunks), chunks[0].text[0]['id'], str(chunks[0])[:9])"
+        )
+        assert '0 [{"id":' in result
+        assert "Chunk(start=0, end=" in repr(agent.state["chunks"][0])
+
+    def test_invalid_arguments(self, agent):
+        """Test bad boundaries and overlaps are rejected."""
+        assert "ValueError" in agent.run("plan_chunks(100, boundary='sentence')")
+        assert "ValueError" in agent.run("plan_chunks(100, overlap=100)")
+
+    def test_memoized_cells_see_new_context(self):
+        """Test memoization treats plan_chunks as reading context."""
+        agent = REPLAgent(memoize=True)
+        agent.load_context(context_str="one\n")
+        cell = "print(plan_chunks(10)[-1].end)"
+        assert "4" in agent.run(cell)
+        agent.append_context("\n\ntwo\n")
+        result = agent.run(cell)
+        assert "10" in result and "[Memoized" not in result
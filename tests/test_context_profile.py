@@ -0,0 +1,59 @@
+"""Tests for the context profile computed by load_context."""
+import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent, format_profile, profile_context
+import pytest
+
+
+@pytest.fixture
+def agent():
+    """Create a fresh REPLAgent instance for each test."""
+    agent = REPLAgent()
+    yield agent
+    del agent
+
+
+class TestContextProfile:
+    """Test profiling of loaded contexts."""
+
+    def test_text_profile(self, agent):
+        """Test counts, format detection and head/middle/tail samples for text."""
+        text = "".join(f"{i},name{i},{i * 2}\n" for i in range(1000))
+        agent.load_context(context_str=text)
+        profile = agent.context_profile
+        assert profile["chars"] == len(text) and profile["lines"] == 1000
+        assert profile["words"] == 1000 and profile["encoding"] == "ascii"
+        assert profile["format"] == "CSV (3 columns)"
+        assert profile["head"].startswith("0,name0,0\n")
+        middle = text.index(profile["middle"])
+        assert len(text) // 3 < middle < 2 * len(text) // 3 and text[middle - 1] == "\n"
+        assert profile["tail"].endswith("999,name999,1998\n")
+        with open(os.path.join(agent.temp_dir, "context.profile.json")) as f:
+            assert json.load(f) == profile
+
+    def test_json_profile(self, agent):
+        """Test JSON contexts get a schema sketch and item count."""
+        agent.load_context(context_json={"users": [{"name": "Ada", "age": 36}] * 3})
+        text = format_profile(agent.context_profile)
+        assert "1 top-level items" in text
+        assert '{"users": {"list[3] of": {"name": "str", "age": "int"}}}' in text
+
+    def test_non_ascii_and_short(self):
+        """Test encoding detection and that short texts are shown once."""
+        profile = profile_context("héllo wörld")
+        assert profile["bytes"] == len("héllo wörld".encode())
+        assert profile["middle"] is None and "middle" not in format_profile(profile)
+
+    def test_profile_prepended_to_first_message(self, agent, fake_client):
+        """Test chat puts the profile before the query unless disabled."""
+        agent.load_context(context_str="alpha\nbeta\n")
+        agent.client = fake_client(["ok", "ok"])
+        agent.chat("What is in context?")
+        first = agent.client.requests[0]["messages"][1]["content"]
+        assert first.startswith("Precomputed profile of `context`")
+        assert "2 lines" in first and first.endswith("What is in context?")
+        agent.chat("Again", include_profile=False)
+        assert agent.client.requests[1]["messages"][1]["content"] == "Again"
@@ -0,0 +1,79 @@
+"""Tests for sharing read-only contexts across agents."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent, ContextRegistry
+import pytest
+
+
+@pytest.fixture
+def registry():
+    """Create a registry private to the test."""
+    return ContextRegistry()
+
+
+class TestContextRegistry:
+    """Test content-addressed, reference-counted shared contexts."""
+
+    def test_str_context_is_one_object(self, registry):
+        """Test agents loading the same text share one str and one file."""
+        text = "\n".join(f"row {i}" for i in range(500))
+        a, b = REPLAgent(registry=registry), REPLAgent(registry=registry)
+        a.load_context(context_str=text, shared=True)
+        b.load_context(context_str="\n".join(f"row {i}" for i in range(500)), shared=True)
+        assert a.state["context"] is b.state["context"]
+        assert a.context_profile is b.context_profile
+        (stats,) = registry.stats().values()
+        assert stats == {"kind": "str", "refs": 2, "chars": len(text)}
+        assert "row 499" in a.run("print(context.splitlines()[-1])")
+        a.close()
+        b.close()
+
+    def test_last_detach_evicts(self, registry):
+        """Test the entry and its file go away when the last agent closes."""
+        a, b = REPLAgent(registry=registry), REPLAgent(registry=registry)
+        a.load_context(context_str="shared text", shared=True)
+        b.load_context(context_str="shared text", shared=True)
+        (entry,) = registry.entries.values()
+        assert os.path.exists(entry.path)
+        a.close()
+        assert entry.refs == 1 and os.path.exists(entry.path)
+        b.close()
+        assert registry.entries == {}
+        assert not os.path.exists(entry.path)
+
+    def test_reload_detaches_previous(self, registry):
+        """Test loading a new context releases the old shared one."""
+        agent = REPLAgent(registry=registry)
+        agent.load_context(context_str="first", shared=True)
+        agent.load_context(context_str="second", shared=True)
+        assert [s["chars"] for s in registry.stats().values()] == [len("second")]
+        agent.load_context(context_str="private")
+        assert registry.entries == {}
+        agent.close()
+
+    def test_json_context_copies_are_private(self, registry):
+        """Test JSON contexts share storage but each agent mutates its own copy."""
+        data = {"items": [1, 2, 3]}
+        a, b = REPLAgent(registry=registry), REPLAgent(registry=registry)
+        a.load_context(context_json=data, shared=True)
+        b.load_context(context_json=data, shared=True)
+        assert len(registry.entries) == 1
+        a.run("context['items'].append(4)")
+        assert b.state["context"] == data
+        a.close()
+        b.close()
+
+    def test_search_index_is_shared(self, registry):
+        """Test search_context builds one index for all attached agents."""
+        text = "\n".join(["filler"] * 100 + ["needle here"])
+        a, b = REPLAgent(registry=registry), REPLAgent(registry=registry)
+        a.load_context(context_str=text, shared=True)
+        b.load_context(context_str=text, shared=True)
+        assert "> 101| needle here" in a.search_context("needle")
+        assert "> 101| needle here" in b.search_context("needle")
+        (entry,) = registry.entries.values()
+        assert entry._index is not None and b._context_index is None
+        a.close()
+        b.close()
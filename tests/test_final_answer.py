@@ -0,0 +1,49 @@
+"""Tests for returning the final answer by reference with final()/FINAL_VAR()."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent
+import pytest
+
+
+@pytest.fixture
+def agent():
+    """Create a fresh REPLAgent instance for each test."""
+    agent = REPLAgent()
+    yield agent
+    del agent
+
+
+class TestFinalAnswer:
+    """Test ending chat with a live object from the REPL namespace."""
+
+    def test_final_var_returns_live_object(self, agent, fake_client):
+        """Test FINAL_VAR ends chat and returns the object without re-generation."""
+        agent.client = fake_client(
+            [
+                [("python_exec", {"code": "items = [i * i for i in range(500)]"})],
+                [("python_exec", {"code": "FINAL_VAR('items')"})],
+                "should not be requested",
+            ]
+        )
+        answer = agent.chat("Square the first 500 integers")
+        assert answer is agent.state["items"]
+        assert len(agent.client.requests) == 2
+        assert agent.final_summary.startswith("list of length 500")
+        assert "Final answer set" in agent.last_messages[-1]["content"]
+
+    def test_final_value_and_reset(self, agent, fake_client):
+        """Test final(value) works and a later chat starts without a final answer."""
+        agent.client = fake_client(
+            [[("python_exec", {"code": "final({'total': 42})"})], "plain answer"]
+        )
+        assert agent.chat("first") == {"total": 42}
+        assert agent.chat("second") == "plain answer"
+        assert agent.final_answer is None
+
+    def test_final_var_unknown_name(self, agent):
+        """Test FINAL_VAR on a missing variable is reported as an error."""
+        result = agent.run("FINAL_VAR('missing')")
+        assert "NameError" in result
+        assert agent._final == {}
@@ -0,0 +1,51 @@
+"""Tests for %time, %timeit and %prun profiling magics."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent
+import pytest
+
+
+@pytest.fixture
+def agent():
+    """Create a fresh REPLAgent instance for each test."""
+    agent = REPLAgent()
+    yield agent
+    del agent
+
+
+class TestMagics:
+    """Test profiling magics recognized by run()."""
+
+    def test_time_runs_cell_in_state(self, agent):
+        """Test %time executes the cell, keeps its output and reports timings."""
+        result = agent.run("%time total = sum(range(1000))\nprint(total)")
+        assert "499500" in result
+        assert "Wall time:" in result and "CPU times:" in result
+        assert "499500" in agent.run("total")
+
+    def test_cell_magic_form(self, agent):
+        """Test %%time applies to the whole following cell."""
+        result = agent.run("%%time\nfor i in range(3):\n    print(i)")
+        assert "0\n1\n2" in result
+        assert "Wall time:" in result
+
+    def test_timeit_reports_statistics(self, agent):
+        """Test %timeit reports mean, std and loop counts without flooding output."""
+        agent.run("data = list(range(100))")
+        result = agent.run("%timeit -n 10 -r 3 print(sum(data))")
+        assert "per loop (mean ± std. dev. of 3 runs, 10 loops each" in result
+        assert "4950" not in result
+
+    def test_prun_lists_cumulative_functions(self, agent):
+        """Test %prun profiles the cell and lists the top functions."""
+        agent.run("def slow():\n    return sorted(range(10000), key=lambda x: -x)")
+        result = agent.run("%prun -l 5 ordered = slow()")
+        assert "Ordered by: cumulative time" in result
+        assert "slow" in result
+
+    def test_magic_errors_are_reported(self, agent):
+        """Test exceptions inside a magic cell surface as errors."""
+        result = agent.run("%time 1 / 0")
+        assert "ZeroDivisionError" in result
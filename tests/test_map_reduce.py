@@ -0,0 +1,54 @@
+"""Tests for map_reduce_chat over parallel sub-agents."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent, map_reduce_chat
+import pytest
+
+
+MAP_CODE = "final({'answer': context.count('needle'), 'evidence': [], 'relevant': True})"
+REDUCE_CODE = "final(sum(p['answer'] for p in context))"
+
+
+class TestMapReduceChat:
+    """Test splitting a context across sub-agents and reducing their answers."""
+
+    def test_counts_across_chunks(self, fake_client):
+        """Test partial answers from every chunk are combined by the reduce step."""
+        agents = []
+
+        def make_agent():
+            agent = REPLAgent()
+            code = REDUCE_CODE if len(agents) == 4 else MAP_CODE
+            agent.client = fake_client([[("python_exec", {"code": code})]])
+            agents.append(agent)
+            return agent
+
+        context = "".join(
+            "needle here\n" if i % 10 == 0 else "hay\n" for i in range(1000)
+        )
+        result = map_reduce_chat(
+            "How many needles?", context, k=4, max_workers=2, make_agent=make_agent
+        )
+        assert result["answer"] == 100
+        assert [p["part"] for p in result["partials"]] == [1, 2, 3, 4]
+        stats = result["stats"]
+        assert stats["chunks"] == 4 and len(stats["map_part_seconds"]) == 4
+        assert stats["map_tokens"] == {"prompt_tokens": 40, "completion_tokens": 20}
+        assert stats["reduce_tokens"] == {"prompt_tokens": 10, "completion_tokens": 5}
+        assert all(agent.scratch.closed for agent in agents)
+
+    def test_custom_chunker_and_text_partials(self, fake_client):
+        """Test a custom chunker and plain-text map answers are wrapped."""
+        def make_agent():
+            agent = REPLAgent()
+            agent.client = fake_client(["partial or final text"])
+            return agent
+
+        result = map_reduce_chat(
+            "q", [1, 2, 3], chunker=lambda ctx, k: [[x] for x in ctx], make_agent=make_agent
+        )
+        assert len(result["partials"]) == 3
+        assert result["partials"][0]["answer"] == "partial or final text"
+        assert result["answer"] == "partial or final text"
@@ -0,0 +1,104 @@
+"""Tests for opt-in memoization of deterministic cells."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent
+import pytest
+
+MEMO = "[Memoized"
+
+
+@pytest.fixture
+def agent():
+    """Create an agent with memoization enabled."""
+    agent = REPLAgent(memoize=True)
+    agent.load_context(context_str="the cat sat on the mat\n" * 100)
+    yield agent
+    del agent
+
+
+class TestMemoization:
+    """Test cached re-execution keyed on code and input versions."""
+
+    def test_identical_cell_is_restored(self, agent):
+        """Test a repeated expensive cell replays its output and variables."""
+        code = "from collections import Counter\ncounts = Counter(context.split())\nprint(counts['the'])"
+        first = agent.run(code)
+        counts = agent.state["counts"]
+        agent.run("counts = None")
+        second = agent.run(code)
+        assert MEMO not in first and MEMO in second
+        assert "200" in second
+        assert agent.state["counts"] is counts
+
+    def test_changed_input_invalidates(self, agent):
+        """Test rebinding an input variable forces re-execution."""
+        code = "n = len(context.split())\nprint(n)"
+        agent.run(code)
+        agent.run("context = context + ' extra'")
+        result = agent.run(code)
+        assert MEMO not in result and "601" in result
+
+    def test_self_dependent_cell_not_replayed(self, agent):
+        """Test cells that update their own inputs run every time."""
+        agent.run("total = 0")
+        agent.run("total = total + 1")
+        agent.run("total = total + 1")
+        assert agent.state["total"] == 2
+        agent.run("items = []")
+        agent.run("items.append(1)")
+        agent.run("items.append(1)")
+        assert agent.state["items"] == [1, 1]
+
+    def test_mutated_cached_object_invalidates(self, agent):
+        """Test a cached object mutated later is not restored stale."""
+        code = "words = sorted(set(context.split()))"
+        agent.run(code)
+        agent.run("words.append('zzz')")
+        result = agent.run(code)
+        assert MEMO not in result
+        assert "zzz" not in agent.state["words"]
+
+    @pytest.mark.parametrize(
+        "code",
+        [
+            "import random\nx = random.random()",
+            "import time\nx = time.time()",
+            "with open('f.txt', 'w') as f:\n    f.write('a')",
+            "x = id(context)",
+        ],
+    )
+    def test_impure_cells_excluded(self, agent, code):
+        """Test cells using randomness, time, I/O or identity are never replayed."""
+        agent.run(code)
+        assert MEMO not in agent.run(code)
+
+    def test_functions_reading_globals(self, agent):
+        """Test REPL functions are tracked through the globals they read."""
+        agent.run("sep = ' '\ndef words():\n    return context.split(sep)")
+        agent.run("w = words()")
+        assert MEMO in agent.run("w = words()")
+        agent.run("sep = 'a'")
+        assert MEMO not in agent.run("w = words()")
+        agent.run("seen = []\ndef track():\n    seen.append(1)\n    return len(seen)")
+        agent.run("r = track()")
+        agent.run("r = track()")
+        assert agent.state["seen"] == [1, 1]
+
+    def test_arguments_mutated_by_callee(self, agent):
+        """Test mutable values passed to functions count as written."""
+        agent.run("import heapq\nh = []")
+        agent.run("heapq.heappush(h, 3)")
+        agent.run("heapq.heappush(h, 3)")
+        assert agent.state["h"] == [3, 3]
+        agent.run("data = []\ndef add(l):\n    l.append(1)")
+        agent.run("add(data)")
+        agent.run("add(data)")
+        assert agent.state["data"] == [1, 1]
+
+    def test_disabled_by_default(self):
+        """Test memoization is opt-in."""
+        agent = REPLAgent()
+        agent.run("x = 1")
+        assert MEMO not in agent.run("x = 1")
@@ -0,0 +1,85 @@
+"""Tests for namespace memory accounting and spill-to-disk."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent
+import pytest
+
+MB = 2**20
+
+
+@pytest.fixture
+def agent():
+    """Create an agent with a 5 MB namespace ceiling."""
+    agent = REPLAgent(memory_limit=5 * MB)
+    yield agent
+    del agent
+
+
+class TestMemoryAccounting:
+    """Test per-variable sizes and spilling of cold values."""
+
+    def test_usage_reported_to_model(self, agent):
+        """Test each cell reports namespace memory against the ceiling."""
+        result = agent.run("data = 'x' * (2 * 1024 * 1024)")
+        assert "[Memory: 2.0 MB of 5.0 MB]" in result
+        usage = agent.state.memory_usage()
+        assert usage["data"]["bytes"] >= 2 * MB and not usage["data"]["spilled"]
+
+    def test_least_recently_used_value_spills_and_reloads(self, agent):
+        """Test the coldest large value goes to disk and comes back on access."""
+        agent.run("old = 'a' * (3 * 1024 * 1024)")
+        agent.run("new = 'b' * (3 * 1024 * 1024)")
+        assert agent.state.spilled.keys() == {"old"}
+        assert "spilled to disk: old" in agent.run("1 + 1")
+        path = agent.state.spilled["old"][0]
+        assert os.path.exists(path)
+
+        result = agent.run("print(len(old), old[:3])")
+        assert "3145728 aaa" in result
+        assert "old" not in agent.state.spilled and not os.path.exists(path)
+        assert "new" in agent.state.spilled  # Now the colder one
+
+    def test_delete_and_reassign_spilled(self, agent):
+        """Test del and re-assignment of spilled names clean up their files."""
+        agent.run("a = 'a' * (3 * 1024 * 1024)")
+        agent.run("b = 'b' * (3 * 1024 * 1024)")
+        path = agent.state.spilled["a"][0]
+        agent.run("del a")
+        assert not os.path.exists(path)
+        assert "NameError" in agent.run("a")
+
+    def test_shared_objects_not_spilled(self, agent):
+        """Test values referenced from elsewhere stay in memory."""
+        agent.run("big = ['x' * 1024 for _ in range(4000)]\nalias = [big]")
+        agent.run("other = 'y' * (3 * 1024 * 1024)")
+        agent.run("x = 'z' * (3 * 1024 * 1024)")
+        assert agent.state.spilled.keys() == {"other"}
+        assert "True" in agent.run("alias[0] is big")
+
+    def test_memory_usage_helper(self):
+        """Test memory_usage() is available in the REPL without a ceiling."""
+        agent = REPLAgent()
+        result = agent.run(
+            "nums = list(range(1000))\nprint(memory_usage()['nums']['bytes'] > 8000)"
+        )
+        assert "True" in result
+        assert "[Memory:" not in result
+
+    def test_deeply_nested_value(self, agent):
+        """Test accounting walks deeply nested values without recursing."""
+        agent.run("x = []")
+        result = agent.run("for i in range(5000):\n    x = [x]")
+        assert "[Memory:" in result and "Error" not in result
+        assert agent.state.memory_usage()["x"]["bytes"] > 5000 * 56
+
+    def test_accounting_failure_is_reported(self, agent, monkeypatch):
+        """Test a failing accounting pass becomes a note instead of raising."""
+        def fail(code):
+            raise MemoryError("boom")
+
+        monkeypatch.setattr(agent.state, "account", fail)
+        result = agent.run("y = 1\nprint(y)")
+        assert result.startswith("1")
+        assert "[Memory accounting failed: MemoryError: boom]" in result
@@ -3,7 +3,7 @@ import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from repl_agent import REPLAgent
+from repl_agent import REPLAgent, count_tokens, elide
 import pytest
 
 
@@ -46,3 +46,49 @@ class TestOutputInState:
         result = agent.run("_stderr")
         # stderr should be accessible
         assert "_stderr" not in result or "Error:" in result
+
+
+class TestTokenBudget:
+    """Test token-based output budgets and elision."""
+
+    def test_estimate_scales_with_script(self):
+        """Test the offline estimate counts CJK text far denser than English."""
+        english = count_tokens("word " * 1000)
+        cjk = count_tokens("漢字" * 500)
+        assert 800 <= english <= 1200
+        assert cjk >= 900
+
+    def test_elide_keeps_head_and_tail_lines(self):
+        """Test elision keeps whole lines from both ends and reports what was cut."""
+        text = "\n".join(f"row {i}" for i in range(5000))
+        result = elide(text, 200)
+        assert result.startswith("row 0\nrow 1\n")
+        assert result.endswith("row 4999")
+        assert "truncated" in result and "lines)" in result
+        assert count_tokens(result) < 300
+
+    def test_trailer_survives_truncation(self, agent):
+        """Test variable and timing info is kept when the cell output is elided."""
+        result = agent.run("big = 'x' * 150000\nprint(big)", max_tokens=100)
+        assert "truncated" in result
+        assert "[Variables: big]" in result and "[Execution:" in result
+
+    def test_budget_is_per_model(self):
+        """Test larger-context models get larger default output budgets."""
+        small, large = REPLAgent(model="gpt-4o-mini"), REPLAgent(model="gpt-4.1")
+        assert small.max_output_tokens < large.max_output_tokens
+        assert REPLAgent(max_output_tokens=123).max_output_tokens == 123
+
+    def test_chat_shrinks_budget_near_context_limit(self, agent, fake_client):
+        """Test tool results get smaller as the conversation fills the window."""
+        code = {"code": "print('y' * 100000)"}
+        agent.client = fake_client([[("python_exec", code)], "done"], usage=(10, 5))
+        agent.chat("go")
+        roomy = agent.last_messages[-1]["content"]
+        agent.client = fake_client(
+            [[("python_exec", code)], "done"], usage=(agent.context_window - 1000, 0)
+        )
+        agent.chat("go")
+        tight = agent.last_messages[-1]["content"]
+        assert len(tight) < len(roomy)
+        assert agent.output_budget == agent.max_output_tokens
@@ -0,0 +1,56 @@
+"""Tests for the pmap/pscan parallel helpers in the REPL namespace."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent, _line_chunks
+import pytest
+
+
+@pytest.fixture
+def agent():
+    """Create a fresh REPLAgent instance for each test."""
+    agent = REPLAgent()
+    yield agent
+    del agent
+
+
+class TestLineChunks:
+    """Test line-aligned chunking of context."""
+
+    def test_chunks_cover_text_on_line_boundaries(self):
+        """Test chunks are contiguous, complete and end on newlines."""
+        text = "".join(f"line {i}\n" for i in range(100)) + "tail"
+        bounds = _line_chunks(text, 7)
+        assert "".join(text[s:e] for s, e in bounds) == text
+        assert all(text[e - 1] == "\n" for s, e in bounds[:-1])
+
+
+class TestParallelHelpers:
+    """Test pmap and pscan from inside REPL code."""
+
+    def test_pmap_over_context(self, agent):
+        """Test pmap runs a REPL-defined function over context chunks in order."""
+        agent.load_context(context_str="a b\nc\nd e f\n" * 50)
+        agent.run("def count_words(chunk):\n    return len(chunk.split())")
+        result = agent.run("print(sum(pmap(count_words, processes=3)))")
+        assert "300" in result
+
+    def test_pmap_explicit_chunks_preserve_order(self, agent):
+        """Test pmap over explicit chunks returns results in input order."""
+        result = agent.run("print(pmap(lambda x: x * 2, [1, 2, 3, 4], processes=2))")
+        assert "[2, 4, 6, 8]" in result
+
+    def test_pscan_offsets(self, agent):
+        """Test pscan returns absolute offsets of regex matches."""
+        agent.load_context(context_str="foo\nbar 42\nbaz 7\n" * 3)
+        result = agent.run(
+            "hits = pscan(r'\\d+', processes=2)\n"
+            "print(all(context[o:o + len(m)] == m for o, m in hits), len(hits))"
+        )
+        assert "True 6" in result
+
+    def test_helpers_hidden_from_variable_list(self, agent):
+        """Test helpers are not reported as user variables."""
+        result = agent.run("x = 1")
+        assert "[Variables: x]" in result
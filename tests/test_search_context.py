@@ -0,0 +1,81 @@
+"""Tests for the native search_context tool."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent
+import pytest
+
+
+@pytest.fixture
+def agent():
+    """Create an agent with a multi-line text context."""
+    agent = REPLAgent()
+    lines = [f"filler line {i}" for i in range(1000)]
+    lines[420] = "The secret code is PINEAPPLE-7."
+    lines[700] = "apple banana cherry together"
+    lines[10] = "apple alone"
+    agent.load_context(context_str="\n".join(lines))
+    yield agent
+    del agent
+
+
+class TestSearchContext:
+    """Test searching context without executing code."""
+
+    def test_literal_hit_window(self, agent):
+        """Test a literal search reports line, offset and neighbouring lines."""
+        result = agent.search_context("secret code", window=1)
+        assert result.startswith("1 matches on 1 lines")
+        assert "[line 421, offset" in result
+        assert "> 421| The secret code is PINEAPPLE-7." in result
+        assert "  420| filler line 419" in result and "  422| filler line 421" in result
+        offset = int(result.split("offset ")[1].split("]")[0])
+        assert agent.state["context"][offset:].startswith("secret code")
+
+    def test_regex_and_max_hits(self, agent):
+        """Test regex mode and the hit cap."""
+        result = agent.search_context(r"line 9\d\d$", mode="regex", max_hits=3, window=0)
+        assert "showing 3" in result
+        assert result.count("[line ") == 3
+
+    def test_terms_ranked_by_coverage(self, agent):
+        """Test terms mode ranks passages containing more keywords first."""
+        result = agent.search_context("apple cherry banana", mode="terms", window=0)
+        hits = [line for line in result.splitlines() if line.startswith("[line")]
+        assert hits[0].startswith("[line 701")
+
+    def test_errors_and_json_context(self, agent):
+        """Test bad patterns are reported and JSON contexts are searchable."""
+        assert agent.search_context("(", mode="regex").startswith("Error: error")
+        agent.load_context(context_json={"users": [{"name": "Ada"}, {"name": "Grace"}]})
+        assert '"name": "Grace"' in agent.search_context("grace")
+
+    def test_tool_call_from_chat(self, agent, fake_client):
+        """Test the model can call search_context as a tool."""
+        agent.client = fake_client(
+            [[("search_context", {"pattern": "pineapple"})], "PINEAPPLE-7"]
+        )
+        assert agent.chat("What is the code?") == "PINEAPPLE-7"
+        assert "> 421|" in agent.last_messages[-1]["content"]
+        assert "search_context" in [t["function"]["name"] for t in agent.tools]
+
+    def test_bad_tool_arguments_do_not_end_chat(self, agent, fake_client):
+        """Test unknown or mistyped tool arguments become an error result."""
+        agent.client = fake_client(
+            [
+                [("search_context", {"pattern": "filler", "limit": 5})],
+                [("search_context", {"pattern": "filler", "max_hits": "2"})],
+                "done",
+            ]
+        )
+        assert agent.chat("Find filler") == "done"
+        tool_results = [m["content"] for m in agent.last_messages if m["role"] == "tool"]
+        assert tool_results[0].startswith("Error: Invalid search_context arguments: unknown arguments: limit")
+        assert "showing 2" in tool_results[1]
+
+    def test_search_respects_timeout(self, agent):
+        """Test a catastrophic regex is cut off by the time limit."""
+        agent.load_context(context_str="a" * 30 + "b")
+        result = agent.search_context(r"(a+)+c", mode="regex", timeout=0.2)
+        assert result.startswith("Error: TimeoutError: Search exceeded")
@@ -0,0 +1,112 @@
+"""Tests for the multi-session REPL server and its client."""
+import os
+import sys
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLClient, REPLServer
+import pytest
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Start a server on a Unix socket for the duration of a test."""
+    server = REPLServer(str(tmp_path / "repl.sock")).start()
+    yield server
+    server.shutdown()
+
+
+class TestREPLServer:
+    """Test session hosting over a local socket."""
+
+    def test_state_persists_across_clients(self, server):
+        """Test a named session keeps its state between client connections."""
+        REPLClient(server.address, session="a").run("x = 41")
+        assert "42" in REPLClient(server.address, session="a").run("x + 1")
+        assert "NameError" in REPLClient(server.address, session="b").run("x")
+
+    def test_load_context_and_snapshot(self, server):
+        """Test loading context remotely and inspecting session memory."""
+        client = REPLClient(server.address, session="ctx")
+        client.load_context(context_str="hello " * 1000)
+        snapshot = client.snapshot()
+        assert snapshot["variables"]["context"]["type"] == "str"
+        assert snapshot["memory"] >= 6000
+        assert "ctx" in server.handle({"op": "sessions"})
+
+    def test_close_and_idle_eviction(self, server):
+        """Test explicit close and eviction of idle sessions."""
+        client = REPLClient(server.address, session="tmp")
+        client.run("y = 1")
+        assert client.close() is True
+        assert "NameError" in client.run("y")
+        server.idle_timeout = 0
+        server.evict_idle()
+        assert server.sessions == {}
+
+    def test_concurrent_sessions(self, server):
+        """Test requests to different sessions are handled concurrently and correctly."""
+        results = {}
+
+        def work(i):
+            client = REPLClient(server.address, session=f"s{i}")
+            client.run(f"n = {i}")
+            results[i] = client.run("n * 10")
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert all(str(i * 10) in results[i] for i in range(8))
+
+    def test_errors_raise_on_client(self, server):
+        """Test server-side failures are raised by the client."""
+        with pytest.raises(RuntimeError, match="TypeError"):
+            REPLClient(server.address)._call("run", nonsense=1)
+
+    def test_sessions_op_skips_busy_sessions(self, server):
+        """Test listing sessions does not walk a namespace another request holds."""
+        client = REPLClient(server.address, session="busy")
+        client.run("z = 'x' * 10000")
+        session = server.sessions["busy"]
+        assert server.handle({"op": "sessions"})["busy"]["memory"] >= 10000
+        with session.lock:
+            report = server.handle({"op": "sessions"})["busy"]
+        assert report["busy"] and report["memory"] >= 10000
+
+    def test_evicted_session_is_not_used(self, server):
+        """Test a request racing eviction gets a fresh session, not a closed agent."""
+        REPLClient(server.address, session="race").run("w = 1")
+        stale = server._session("race")
+        server.idle_timeout = 0
+        server.evict_idle()
+        assert stale.closed
+        lookups = [stale]
+        lookup = server._session
+        server._session = lambda name, model=None: (
+            lookups.pop() if lookups else lookup(name, model)
+        )
+        assert "NameError" in server.handle({"op": "run", "session": "race", "args": {"code": "w"}})
+
+
+class TestServerAuth:
+    """Test the server refuses unauthenticated remote access."""
+
+    def test_non_loopback_requires_token(self):
+        """Test binding a public host without a token is refused."""
+        with pytest.raises(ValueError, match="without a token"):
+            REPLServer(("0.0.0.0", 0))
+
+    def test_token_checked(self):
+        """Test requests without the right token are rejected."""
+        server = REPLServer(("127.0.0.1", 0), token="s3cret").start()
+        address = server.server.server_address
+        try:
+            with pytest.raises(RuntimeError, match="PermissionError"):
+                REPLClient(address).run("1")
+            with pytest.raises(RuntimeError, match="PermissionError"):
+                REPLClient(address, token="wrong").run("1")
+            assert "2" in REPLClient(address, token="s3cret").run("1 + 1")
+        finally:
+            server.shutdown()
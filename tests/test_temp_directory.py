@@ -3,7 +3,7 @@ import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from repl_agent import REPLAgent
+from repl_agent import REPLAgent, SCRATCH_PREFIX, ScratchDir, sweep_orphans
 import pytest
 
 
@@ -69,3 +69,46 @@ class TestTempDirectoryCleanup:
 
         # Temp directory should be cleaned up
         assert not os.path.exists(temp_dir)
+
+
+class TestScratchDir:
+    """Test scratch directory lifecycle, placement and quotas."""
+
+    def test_close_and_context_manager(self):
+        """Test close() and the with-statement remove the directory immediately."""
+        with REPLAgent() as agent:
+            temp_dir = agent.temp_dir
+            agent.run("with open('a.txt', 'w') as f: f.write('a')")
+            assert os.path.exists(temp_dir)
+        assert not os.path.exists(temp_dir)
+        agent.close()  # Idempotent
+        assert "Error:" in agent.run("1 + 1")
+
+    def test_in_memory_placement(self):
+        """Test scratch dirs can be placed on tmpfs when available."""
+        scratch = ScratchDir(in_memory=True)
+        if os.path.isdir("/dev/shm"):
+            assert scratch.path.startswith("/dev/shm/")
+        scratch.close()
+        assert scratch.closed and not os.path.exists(scratch.path)
+
+    def test_quota_enforced(self):
+        """Test cells and context loading report quota overruns."""
+        agent = REPLAgent(scratch_quota=1000)
+        result = agent.run("with open('big.bin', 'wb') as f: f.write(b'x' * 5000)")
+        assert "Scratch quota exceeded" in result
+        agent.run("import os\nos.remove('big.bin')")
+        assert "Error:" not in agent.run("1 + 1")
+        with pytest.raises(OSError, match="quota"):
+            agent.load_context(context_str="y" * 2000)
+        agent.close()
+
+    def test_orphan_sweep(self, tmp_path):
+        """Test dirs owned by dead processes are removed, live ones kept."""
+        dead = tmp_path / f"{SCRATCH_PREFIX}999999999_abc"
+        live = tmp_path / f"{SCRATCH_PREFIX}{os.getpid()}_abc"
+        other = tmp_path / "unrelated_999999999"
+        for d in (dead, live, other):
+            d.mkdir()
+        assert sweep_orphans(str(tmp_path)) == [str(dead)]
+        assert live.exists() and other.exists()
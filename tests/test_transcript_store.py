@@ -0,0 +1,50 @@
+"""Tests for the sqlite transcript store."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repl_agent import REPLAgent, TranscriptStore
+import pytest
+
+
+class TestTranscriptStore:
+    """Test recording chat sessions and querying them."""
+
+    def test_chat_is_recorded(self, fake_client):
+        """Test messages, tool calls and token usage are recorded per session."""
+        store = TranscriptStore()
+        agent = REPLAgent(transcript=store)
+        agent.client = fake_client(
+            [[("python_exec", {"code": "x = 6 * 7\nx"})], "The answer is 42."]
+        )
+        assert agent.chat("What is 6 * 7?") == "The answer is 42."
+
+        [session] = store.sessions()
+        assert session["id"] == agent.session_id
+        assert session["iterations"] == 2
+        assert session["prompt_tokens"] == 20 and session["completion_tokens"] == 10
+        roles = [m["role"] for m in store.messages(agent.session_id)]
+        assert roles == ["system", "user", "assistant", "tool", "assistant"]
+        [call] = store.tool_calls(agent.session_id)
+        assert call["code"] == "x = 6 * 7\nx"
+        assert "42" in call["result"]
+        del agent
+
+    def test_queries(self, fake_client, tmp_path):
+        """Test filtering sessions and ranking slow cells in a file-backed store."""
+        store = TranscriptStore(str(tmp_path / "transcripts.db"))
+        for model, script in [
+            ("gpt-4o-mini", ["done"]),
+            ("gpt-4o", [[("python_exec", {"code": "import time\ntime.sleep(0.05)"})],
+                        [("python_exec", {"code": "1 + 1"})], "done"]),
+        ]:
+            agent = REPLAgent(model=model, transcript=store)
+            agent.client = fake_client(script)
+            agent.chat("go")
+            del agent
+
+        assert [s["model"] for s in store.sessions(min_iterations=3)] == ["gpt-4o"]
+        assert len(store.sessions(model="gpt-4o-mini")) == 1
+        slowest = store.slowest_calls(limit=1)
+        assert "sleep" in slowest[0]["code"]
+        store.close()